@@ -0,0 +1,218 @@
+"""A minimal non-blocking memcache client, for profiling async gets.
+
+pylibmc only makes blocking calls, so there's no way to have many gets in
+flight at once from one thread like Standard's get_multi_async. This client
+speaks just enough of the memcache binary protocol to send a get on each of
+a number of connections at once, and then waits for the responses in a
+poll() loop, recording when each one completes.
+
+The connections (authenticated with SASL, if the server needs it) are kept
+open between calls and reused, so the gets don't pay for connecting.
+"""
+import errno
+import select
+import socket
+import struct
+import threading
+import time
+
+# the header of binary protocol requests and responses:
+# magic, opcode, key length, extras length, data type,
+# vbucket id (requests) or status (responses), total body length,
+# opaque, CAS
+HEADER = struct.Struct('!BBHBBHIIQ')
+REQUEST_MAGIC = 0x80
+RESPONSE_MAGIC = 0x81
+OPCODE_GET = 0x00
+OPCODE_SASL_AUTH = 0x21
+STATUS_OK = 0x0000
+STATUS_KEY_NOT_FOUND = 0x0001
+
+# the poll() events that mean a connection is broken
+POLL_ERRORS = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+
+class _Request(object):
+    """A request in flight on its own connection."""
+
+    def __init__(self, sock, opcode, key, value=''):
+        self.sock = sock
+        self.key = key
+        self.request = HEADER.pack(REQUEST_MAGIC, opcode, len(key),
+                                   0, 0, 0, len(key) + len(value), 0,
+                                   0) + key + value
+        self.response = bytearray()
+        self.status = None
+        self.value = None
+
+    def send(self):
+        """Send as much of the request as the socket will take."""
+        try:
+            sent = self.sock.send(self.request)
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            sent = 0
+        self.request = self.request[sent:]
+
+    def receive(self):
+        """Read what we can of the response, and parse it if it's all here.
+
+        Return: whether the response is complete.
+        """
+        chunk = self.sock.recv(1 << 16)
+        if not chunk:
+            raise RuntimeError("Memcache connection closed during request!")
+        self.response.extend(chunk)
+        if len(self.response) < HEADER.size:
+            return False
+        (magic, _, key_length, extras_length, _, status, body_length,
+         _, _) = HEADER.unpack_from(self.response)
+        if len(self.response) < HEADER.size + body_length:
+            return False
+        if magic != RESPONSE_MAGIC:
+            raise RuntimeError("Bad memcache response magic: %s" % magic)
+        self.status = status
+        if status == STATUS_OK:
+            self.value = bytes(self.response[HEADER.size + extras_length +
+                                             key_length:])
+        return True
+
+
+def _is_idle(sock):
+    """Check that an idle connection hasn't been closed by the server.
+
+    An idle connection has nothing to read, so if poll() says it's
+    readable, the server has hung up (or sent something we didn't ask for).
+    """
+    poller = select.poll()
+    poller.register(sock, select.POLLIN)
+    return not poller.poll(0)
+
+
+class AsyncMemcacheClient(object):
+    """A client that makes many gets at once, each on its own connection."""
+
+    def __init__(self, server, username=None, password=None, max_idle=256):
+        """Create the client.
+
+        - server: the memcache server, as host:port
+        - username, password: the SASL credentials, if the server needs them
+        - max_idle: the max number of connections to keep open between calls
+        """
+        host, port = server.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.username = username
+        self.password = password
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Open a new connection, and authenticate it if need be."""
+        sock = socket.create_connection(self.address)
+        try:
+            if self.username:
+                # SASL PLAIN: the mechanism is the key, and the value is
+                # the (empty) authorization id, username and password
+                auth = _Request(sock, OPCODE_SASL_AUTH, 'PLAIN',
+                                '\0%s\0%s' % (self.username, self.password))
+                sock.sendall(auth.request)
+                while not auth.receive():
+                    pass
+                if auth.status != STATUS_OK:
+                    raise RuntimeError("Memcache SASL auth failed!")
+        except Exception:
+            sock.close()
+            raise
+        sock.setblocking(0)
+        return sock
+
+    def _checkout(self, num_connections):
+        """Take idle connections, and open new ones if there aren't enough."""
+        with self._lock:
+            socks = self._idle[-num_connections:]
+            del self._idle[-num_connections:]
+        live = []
+        for sock in socks:
+            if _is_idle(sock):
+                live.append(sock)
+            else:
+                sock.close()
+        while len(live) < num_connections:
+            live.append(self._connect())
+        return live
+
+    def _checkin(self, socks):
+        """Keep connections for later calls, closing any we don't need."""
+        with self._lock:
+            keep = max(0, self.max_idle - len(self._idle))
+            self._idle.extend(socks[:keep])
+        for sock in socks[keep:]:
+            sock.close()
+
+    def get_many(self, keys, sleep=False, deadline=1):
+        """Make a get for each key at once, and wait for all of them.
+
+        The connections are taken from the pool (or opened and
+        authenticated) before the gets are sent, so the timing doesn't
+        include connecting.
+        - keys: the keys to get (a key may be repeated)
+        - sleep: whether to sleep between checks for finished gets, rather
+          than polling as fast as we can
+        - deadline: the number of seconds to wait for the gets
+        Return: the value of each get (None if the key was missing), and
+                the time from sending the gets until each one finished.
+        """
+        if not keys:
+            return [], []
+        socks = self._checkout(len(keys))
+        finished = False
+        try:
+            gets = [_Request(sock, OPCODE_GET, key)
+                    for (sock, key) in zip(socks, keys)]
+            times = [None] * len(gets)
+            pending = {get.sock.fileno(): (i, get)
+                       for (i, get) in enumerate(gets)}
+            poller = select.poll()
+
+            start = time.time()
+            stop = start + deadline
+            for get in gets:
+                get.send()
+                poller.register(get.sock, select.POLLIN |
+                                (select.POLLOUT if get.request else 0))
+            while pending:
+                if time.time() > stop:
+                    raise Exception('RPC deadline exceeded')
+                # poll for finished gets, like _wait_any_fast on Standard
+                for (fd, event) in poller.poll(0):
+                    i, get = pending[fd]
+                    if event & select.POLLOUT:
+                        get.send()
+                        if not get.request:
+                            poller.modify(fd, select.POLLIN)
+                    if event & select.POLLIN:
+                        if get.receive():
+                            times[i] = time.time() - start
+                            if get.status not in (STATUS_OK,
+                                                  STATUS_KEY_NOT_FOUND):
+                                raise RuntimeError(
+                                    "Memcache get failed with status %s" %
+                                    get.status)
+                            poller.unregister(fd)
+                            del pending[fd]
+                    elif event & POLL_ERRORS:
+                        raise RuntimeError("Memcache connection failed "
+                                           "during get!")
+                if sleep and pending:
+                    time.sleep(0.0001)
+            finished = True
+            return [request.value for request in gets], times
+        finally:
+            if finished:
+                self._checkin(socks)
+            else:
+                # a connection with a half-read response can't be reused
+                for sock in socks:
+                    sock.close()
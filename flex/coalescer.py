@@ -0,0 +1,87 @@
+"""Coalesce concurrent memcache gets into get_multi calls.
+
+get_multi costs much less per key than a get for each key (see
+profile_memcache.multi), but handlers each make their own gets. A Coalescer
+collects the gets that arrive within a short window (or until there are
+enough of them) and sends them as one get_multi, then hands each caller its
+value. The first caller into a batch waits out the window and makes the
+get_multi itself, so there's no background thread.
+"""
+import sys
+import threading
+
+if sys.version_info[0] < 3:
+    # (this is a syntax error on python 3, which can't even compile it;
+    # see workers.py)
+    exec('def _reraise(exc_info):\n'
+         '    raise exc_info[0], exc_info[1], exc_info[2]\n')
+else:
+    def _reraise(exc_info):
+        raise exc_info[1].with_traceback(exc_info[2])
+
+
+class _Batch(object):
+    """The gets waiting to be sent in one get_multi."""
+
+    def __init__(self):
+        self.keys = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.values = None
+        self.error = None
+
+
+class Coalescer(object):
+    """Batches gets from many threads into get_multi calls."""
+
+    def __init__(self, get_multi, window=0.001, max_batch=100):
+        """Create the coalescer.
+
+        - get_multi: the function to get a list of keys with, returning a
+          dict of the values found
+        - window: the number of seconds to wait for more gets to batch
+        - max_batch: the max number of gets in a batch (a full batch is
+          sent without waiting for the rest of the window)
+        """
+        self.get_multi = get_multi
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self._batch = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get a key, in a get_multi with any other gets made around now.
+
+        Return: the value (None if the key was missing).
+        """
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+                self.batches += 1
+            batch.keys.append(key)
+            if len(batch.keys) >= self.max_batch:
+                # later gets go in a new batch
+                self._batch = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            try:
+                batch.values = self.get_multi(list(set(batch.keys)))
+            except Exception:
+                batch.error = sys.exc_info()
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error:
+            # with the traceback of the get_multi that failed
+            _reraise(batch.error)
+        return batch.values.get(key)
@@ -0,0 +1,130 @@
+"""A bounded in-process cache in front of a memcache client.
+
+Reads that hit the local cache don't leave the process at all. The cache
+holds at most max_bytes of keys and values, evicting the least recently
+used entries to make room, and entries can expire after a TTL or be
+invalidated explicitly.
+"""
+import collections
+import threading
+import time
+
+
+class LocalCache(object):
+    """An LRU cache (with TTLs) that reads through to a memcache client."""
+
+    def __init__(self, client, max_bytes, ttl=None):
+        """Create an empty cache.
+
+        - client: the memcache client to read through to
+        - max_bytes: the max number of bytes of keys and values to hold
+        - ttl: the default number of seconds entries live for (None for
+          as long as they fit)
+        """
+        self.client = client
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (value, expiry time), least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        """Get a key's value from the local cache, or None if it's not there.
+
+        This has to be called with the lock held.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires < time.time():
+            self.size -= len(key) + len(value)
+            return None
+        # put it back at the most recently used end
+        self._entries[key] = entry
+        return value
+
+    def _store(self, key, value, ttl):
+        """Put a value in the local cache, evicting entries to make room.
+
+        This has to be called with the lock held.
+        """
+        self._discard(key)
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        while self.size + size > self.max_bytes:
+            old_key, (old_value, _) = self._entries.popitem(last=False)
+            self.size -= len(old_key) + len(old_value)
+            self.evictions += 1
+        expires = time.time() + ttl if ttl is not None else None
+        self._entries[key] = (value, expires)
+        self.size += size
+
+    def _discard(self, key):
+        """Drop a key from the local cache, if it's there.
+
+        This has to be called with the lock held.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(key) + len(entry[0])
+
+    def get(self, key):
+        """Get a key, from the local cache if we can and memcache if not.
+
+        Return: the value (None if the key was missing).
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = self.client.get(key)
+        if value is not None:
+            with self._lock:
+                self._store(key, value, self.ttl)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Set a key in memcache and the local cache.
+
+        - ttl: the number of seconds the local entry lives for (defaults to
+          the cache's ttl)
+        Return: whether the memcache set succeeded.
+        """
+        success = self.client.set(key, value)
+        with self._lock:
+            if success:
+                self._store(key, value, ttl if ttl is not None else self.ttl)
+            else:
+                self._discard(key)
+        return success
+
+    def delete(self, key):
+        """Delete a key from memcache and the local cache."""
+        self.invalidate(key)
+        return self.client.delete(key)
+
+    def invalidate(self, key):
+        """Drop a key from the local cache only (e.g. if it's changed)."""
+        with self._lock:
+            self._discard(key)
+
+    def stats(self):
+        """Get the hit/miss counts and memory use of the cache."""
+        with self._lock:
+            reads = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / reads if reads else None,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.size,
+            }
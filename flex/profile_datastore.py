@@ -1,13 +1,35 @@
 """Some functions for making datastore requests."""
-import base64
-import os
+import random
+import threading
 import time
+import uuid
 
 import google.cloud.datastore
+import google.cloud.exceptions
 import google.appengine.ext.db
 import google.appengine.ext.ndb
 
 import models
+import payloads
+import workers
+
+# the process-wide datastore client (see get_client())
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Get the process-wide datastore client, creating it on first use.
+
+    Making a client loads the credentials and sets up its connection, which
+    we don't want to pay for (or measure) on every request. The client's
+    connection is reused by every request in the process.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = google.cloud.datastore.Client()
+        return _client
 
 
 def single_datastore(num_bytes):
@@ -17,12 +39,12 @@ def single_datastore(num_bytes):
     Return: the time for put, get, and delete operations,
             and whether the data access succeeded.
     """
-    ds = google.cloud.datastore.Client()
+    ds = get_client()
     key = ds.key('Sample', 'sample_row')
     sample = google.cloud.datastore.Entity(key=key)
     sample.update({
-        'name': base64.b64encode(os.urandom(num_bytes)),
-        'email': base64.b64encode(os.urandom(num_bytes))
+        'name': payloads.get_text(num_bytes),
+        'email': payloads.get_text(num_bytes)
     })
 
     # time put
@@ -56,14 +78,14 @@ def multi_datastore(num_bytes, num_entities):
     Return: the time for put, get, and delete operations,
             and whether the data access succeeded.
     """
-    ds = google.cloud.datastore.Client()
+    ds = get_client()
     entities, keys = [], []
     for i in range(num_entities):
         keys.append(ds.key('Sample', 'row%s' % i))
         entities.append(google.cloud.datastore.Entity(key=keys[-1]))
         entities[-1].update({
-            'name': base64.b64encode(os.urandom(num_bytes)),
-            'email': base64.b64encode(os.urandom(num_bytes))
+            'name': payloads.get_text(num_bytes),
+            'email': payloads.get_text(num_bytes)
         })
 
     # time put
@@ -102,8 +124,8 @@ def single_ndb(num_bytes):
 
     # create an entity
     sample = sample = models.SampleNdbModel(
-        name=base64.b64encode(os.urandom(num_bytes)),
-        email=base64.b64encode(os.urandom(num_bytes)))
+        name=payloads.get_text(num_bytes),
+        email=payloads.get_text(num_bytes))
 
     # time put
     put_start = time.time()
@@ -144,8 +166,8 @@ def multi_ndb(num_bytes, num_entities):
     entities = []
     for i in range(num_entities):
         entities.append(models.SampleNdbModel(
-            name=base64.b64encode(os.urandom(num_bytes)),
-            email=base64.b64encode(os.urandom(num_bytes))))
+            name=payloads.get_text(num_bytes),
+            email=payloads.get_text(num_bytes)))
 
     # time put
     put_start = time.time()
@@ -168,3 +190,321 @@ def multi_ndb(num_bytes, num_entities):
         'del_time': delete_end - delete_start,
         'correct': result == entities
     }
+
+
+def mixed_datastore(num_bytes, num_ops, workload):
+    """Make a mix of gets and puts of entities from a persistent keyspace.
+
+    The entities are left in datastore for later requests.
+    - num_bytes: number of bytes to assign to data properties
+    - num_ops: number of operations to make
+    - workload: the workload.Workload to draw the operations from
+    Return: the total and mean time for the gets and for the puts, the
+            number of operations per second, the fraction of gets that
+            found an entity, and the number of distinct keys used. The
+            means are None if there were no gets (or puts).
+    """
+    ds = get_client()
+    ops = workload.ops(num_ops)
+
+    results = []
+    start = time.time()
+    for (is_write, name) in ops:
+        key = ds.key('Sample', name)
+        op_start = time.time()
+        if is_write:
+            sample = google.cloud.datastore.Entity(key=key)
+            sample.update({
+                'name': payloads.get_text(num_bytes),
+                'email': payloads.get_text(num_bytes)
+            })
+            ds.put(sample)
+            found = True
+        else:
+            found = ds.get(key) is not None
+        results.append((is_write, found, time.time() - op_start))
+    end = time.time()
+
+    get_times = [t for (is_write, _, t) in results if not is_write]
+    put_times = [t for (is_write, _, t) in results if is_write]
+    hits = sum(1 for (is_write, found, _) in results
+               if found and not is_write)
+    return {
+        'get_time': sum(get_times, 0.0),
+        'set_time': sum(put_times, 0.0),
+        'mean_get_time': (sum(get_times) / len(get_times) if get_times
+                          else None),
+        'mean_set_time': (sum(put_times) / len(put_times) if put_times
+                          else None),
+        'ops_per_sec': num_ops / (end - start),
+        'hit_ratio': float(hits) / len(get_times) if get_times else None,
+        'reads': len(get_times),
+        'writes': len(put_times),
+        'distinct_keys': len(set(key for (_, key) in ops)),
+        # (the puts and gets raise if they fail)
+        'correct': True,
+    }
+
+
+def _put_get_delete(ds, key, num_bytes):
+    """Time a put, get and delete of an entity with the given client.
+
+    Return: the times for the put, get and delete, and whether the get
+            returned the entity we put.
+    """
+    sample = google.cloud.datastore.Entity(key=key)
+    sample.update({
+        'name': payloads.get_text(num_bytes),
+        'email': payloads.get_text(num_bytes)
+    })
+
+    put_start = time.time()
+    ds.put(sample)
+    put_end = time.time()
+
+    get_start = time.time()
+    result = ds.get(key)
+    get_end = time.time()
+
+    delete_start = time.time()
+    ds.delete(key)
+    delete_end = time.time()
+
+    return (put_end - put_start, get_end - get_start,
+            delete_end - delete_start, result == sample)
+
+
+def client_setup(num_bytes):
+    """Compare a cold datastore client with the warm process-wide one.
+
+    A new client is made (and timed), and a put/get/delete is made with it,
+    which includes setting up its connection. Then the same is made with
+    the process-wide client, as every other request does.
+    - num_bytes: number of bytes to assign to data properties
+    Return: the time to make the client, the times for the put, get and
+            delete with the new client and with the warm one, and whether
+            the data access succeeded.
+    """
+    # make sure the process-wide client is warm, so its timing doesn't
+    # include setting it up if this is the first request
+    warm = get_client()
+    warm.get(warm.key('Sample', 'client_setup_warmup'))
+
+    # time making a client
+    client_start = time.time()
+    cold = google.cloud.datastore.Client()
+    client_end = time.time()
+
+    # time the operations with the new and warm clients
+    cold_put, cold_get, cold_delete, cold_correct = _put_get_delete(
+        cold, cold.key('Sample', 'client_setup_cold'), num_bytes)
+    put, get, delete, correct = _put_get_delete(
+        warm, warm.key('Sample', 'client_setup_warm'), num_bytes)
+
+    return {
+        'client_time': client_end - client_start,
+        'cold_set_time': cold_put,
+        'cold_get_time': cold_get,
+        'cold_del_time': cold_delete,
+        'set_time': put,
+        'get_time': get,
+        'del_time': delete,
+        'correct': cold_correct and correct,
+    }
+
+
+def _chunks(items, chunk_size):
+    """Split a list into chunks of (at most) chunk_size items."""
+    return [items[i:i + chunk_size] for i in xrange(0, len(items), chunk_size)]
+
+
+def _timed(fn, *args):
+    """Call fn(*args), and return its result and how long it took."""
+    start = time.time()
+    result = fn(*args)
+    return result, time.time() - start
+
+
+def chunked_datastore(num_bytes, num_entities, chunk_size, num_threads):
+    """Make a batch request to datastore db, in chunks sent in parallel.
+
+    Each chunk is its own put_multi/get_multi/delete_multi call, and the
+    calls are made by a process-wide pool of num_threads threads.
+    - num_bytes: number of bytes to assign to data properties
+    - num_entities: number of entities to send in all
+    - chunk_size: max number of entities in each call
+    - num_threads: max number of calls to make at once
+    Return: the time for all of the put, get, and delete calls, the time
+            each call took, the number of chunks, the number of entities
+            put/got/deleted per second, and whether the data access
+            succeeded.
+    """
+    ds = get_client()
+    entities, keys = [], []
+    for i in range(num_entities):
+        keys.append(ds.key('Sample', 'row%s' % i))
+        entities.append(google.cloud.datastore.Entity(key=keys[-1]))
+        entities[-1].update({
+            'name': payloads.get_text(num_bytes),
+            'email': payloads.get_text(num_bytes)
+        })
+    chunks = _chunks(entities, chunk_size)
+    key_chunks = _chunks(keys, chunk_size)
+
+    # get the process-wide pool of threads to make the calls in
+    pool = workers.get_pool(num_threads)
+
+    # time put
+    put_start = time.time()
+    results = pool.map(_timed, [(ds.put_multi, chunk) for chunk in chunks])
+    put_end = time.time()
+    put_times = [t for (_, t) in results]
+
+    # time get
+    get_start = time.time()
+    results = pool.map(_timed, [(ds.get_multi, chunk)
+                                for chunk in key_chunks])
+    get_end = time.time()
+    get_times = [t for (_, t) in results]
+    result = [entity for (chunk, _) in results for entity in chunk]
+
+    # time delete
+    delete_start = time.time()
+    results = pool.map(_timed, [(ds.delete_multi, chunk)
+                                for chunk in key_chunks])
+    delete_end = time.time()
+    delete_times = [t for (_, t) in results]
+
+    return {
+        'set_time': put_end - put_start,
+        'get_time': get_end - get_start,
+        'del_time': delete_end - delete_start,
+        'set_chunk_times': put_times,
+        'get_chunk_times': get_times,
+        'del_chunk_times': delete_times,
+        'chunks': len(chunks),
+        'entities_per_sec': 3 * num_entities / ((put_end - put_start) +
+                                                (get_end - get_start) +
+                                                (delete_end - delete_start)),
+        'correct': sorted(result) == sorted(entities),
+    }
+
+
+def schema_datastore(schema, num_entities):
+    """Make a batch request to datastore db, of entities of a generated schema.
+
+    - schema: the schema.Schema of the entities
+    - num_entities: number of entities to send in batch request
+    Return: the time for put, get, and delete operations, the number of
+            properties, and whether the data access succeeded.
+    """
+    ds = get_client()
+    keys = [ds.key(schema.kind, 'row%s' % i) for i in range(num_entities)]
+    entities = [schema.entity(key) for key in keys]
+
+    # time put
+    put_start = time.time()
+    ds.put_multi(entities)
+    put_end = time.time()
+
+    # time get
+    get_start = time.time()
+    result = ds.get_multi(keys)
+    get_end = time.time()
+
+    # time delete
+    delete_start = time.time()
+    ds.delete_multi(keys)
+    delete_end = time.time()
+
+    return {
+        'set_time': put_end - put_start,
+        'get_time': get_end - get_start,
+        'del_time': delete_end - delete_start,
+        'props': schema.num_props,
+        'correct': sorted(result) == sorted(entities),
+    }
+
+
+def contended_datastore(num_workers, num_keys, num_groups, num_txns,
+                        max_retries):
+    """Contend for shared counters with transactions from many workers.
+
+    Each worker makes num_txns transactions, each of which adds one to a
+    random counter, retrying (up to max_retries times) if it conflicts
+    with another transaction. The counters are in a namespace of their own,
+    so concurrent requests don't add to each other's counters, and are
+    deleted when we're done.
+    - num_workers: number of workers making transactions at once
+    - num_keys: number of counters they share
+    - num_groups: number of entity groups the counters are spread over
+      (0 to make each counter its own entity group)
+    - num_txns: number of transactions each worker makes
+    - max_retries: max number of times to retry a transaction
+    Return: the mean time for a transaction to commit (including its
+            retries) and the time for each, the total and max number of
+            retries, the number of transactions that gave up, the number
+            committed per second, and whether the counters add up.
+    """
+    if num_workers < 1 or num_keys < 1 or num_txns < 1:
+        raise ValueError("Need at least one worker, counter and transaction")
+    if num_groups < 0 or max_retries < 0:
+        raise ValueError("Groups and retries can't be negative")
+
+    ds = get_client()
+    namespace = 'profile_contention_%s' % uuid.uuid4().hex
+
+    def key(i):
+        if num_groups:
+            return ds.key('ContentionGroup', 'group%d' % (i % num_groups),
+                          'Counter', 'counter%d' % i, namespace=namespace)
+        return ds.key('Counter', 'counter%d' % i, namespace=namespace)
+    keys = [key(i) for i in xrange(num_keys)]
+
+    def increment():
+        """Add one to a random counter, retrying on conflicts.
+
+        Return: the time it took, the number of retries, and whether it
+                committed.
+        """
+        counter_key = random.choice(keys)
+        txn_start = time.time()
+        for retry in xrange(max_retries + 1):
+            try:
+                with ds.transaction():
+                    counter = ds.get(counter_key)
+                    if counter is None:
+                        counter = google.cloud.datastore.Entity(
+                            key=counter_key)
+                    counter['count'] = counter.get('count', 0) + 1
+                    ds.put(counter)
+                return time.time() - txn_start, retry, True
+            except google.cloud.exceptions.Conflict:
+                pass
+        return time.time() - txn_start, max_retries, False
+
+    def worker():
+        return [increment() for _ in xrange(num_txns)]
+
+    # get the process-wide pool of threads to make the transactions in
+    pool = workers.get_pool(num_workers)
+
+    start = time.time()
+    results = pool.map(worker, [()] * num_workers)
+    end = time.time()
+    counts = [e.get('count', 0) for e in ds.get_multi(keys)]
+    ds.delete_multi(keys)
+
+    txn_times = [t for r in results for (t, _, _) in r]
+    retries = [n for r in results for (_, n, _) in r]
+    committed = sum(1 for r in results for (_, _, ok) in r if ok)
+    return {
+        'commit_time': sum(txn_times) / len(txn_times),
+        'commit_times': txn_times,
+        'retries': sum(retries),
+        'max_retries': max(retries),
+        'failures': len(txn_times) - committed,
+        'txns_per_sec': committed / (end - start),
+        # every committed transaction added one to a counter
+        'correct': sum(counts) == committed,
+    }
@@ -1,13 +1,20 @@
 """Some convenience methods for profiling memcache."""
 import base64
+import contextlib
 import logging
 import os
-import Queue
-import threading
+import random
 import time
+import zlib
 
 import pylibmc
 
+import async_memcache
+import coalescer
+import local_cache
+import payloads
+import workers
+
 # [START client]
 # Environment variables are defined in app.yaml.
 if os.environ.get('USE_GAE_MEMCACHE'):
@@ -23,9 +30,113 @@ MEMCACHE_PASSWORD = os.environ.get('MEMCACHE_PASSWORD')
 memcache_client = pylibmc.Client(
     [MEMCACHE_SERVER], binary=True,
     username=MEMCACHE_USERNAME, password=MEMCACHE_PASSWORD)
-memcache = memcache_client
 # [END client]
 
+# pylibmc clients can't be used by more than one thread at a time, so each
+# thread borrows a clone of memcache_client from this pool (see borrow()).
+MEMCACHE_POOL_SIZE = int(os.environ.get('MEMCACHE_POOL_SIZE', '16'))
+memcache_pool = pylibmc.ClientPool(memcache_client, MEMCACHE_POOL_SIZE)
+
+
+@contextlib.contextmanager
+def borrow(waits=None):
+    """Borrow a memcache client from the pool, waiting for one if need be.
+
+    - waits: a list to append the time we waited for the client to
+    """
+    wait_start = time.time()
+    with memcache_pool.reserve(block=True) as client:
+        if waits is not None:
+            waits.append(time.time() - wait_start)
+        yield client
+
+
+# the client for making async gets (see repeated())
+async_client = async_memcache.AsyncMemcacheClient(
+    MEMCACHE_SERVER, MEMCACHE_USERNAME, MEMCACHE_PASSWORD)
+
+
+# The max size of a memcache value: memcache's item limit is 1 MB, which
+# has to fit the key and memcache's own overhead as well as the value.
+MAX_VALUE_SIZE = 1000 * 1000
+
+
+def _num_chunks(length, chunk_size=MAX_VALUE_SIZE):
+    """Get the number of chunks a value of the given length is split into."""
+    return max(1, (length + chunk_size - 1) // chunk_size)
+
+
+def _chunk_keys(key, num_chunks):
+    """Get the keys of the chunks of a chunked value."""
+    return ['%s:%d' % (key, i) for i in xrange(num_chunks)]
+
+
+def set_chunked(client, key, data, chunk_size=MAX_VALUE_SIZE):
+    """Set a value that may be too big for memcache, in chunks.
+
+    The value is split across as many keys as it needs (key:0, key:1, ...)
+    and key itself gets a manifest of the number of chunks, the length and
+    a checksum of the value. They're all set in a single set_multi.
+    - client: the memcache client to use
+    - chunk_size: the max number of bytes in each chunk
+    Return: the keys that failed to be set (as set_multi).
+    """
+    view = memoryview(data)
+    num_chunks = _num_chunks(len(data), chunk_size)
+    values = {chunk_key: view[i * chunk_size:(i + 1) * chunk_size].tobytes()
+              for (i, chunk_key) in enumerate(_chunk_keys(key, num_chunks))}
+    values[key] = '%d:%d:%d' % (num_chunks, len(data),
+                                zlib.crc32(data) & 0xffffffff)
+    return client.set_multi(values)
+
+
+def get_chunked(client, key, max_length, chunk_size=MAX_VALUE_SIZE):
+    """Get a value set by set_chunked.
+
+    The chunk keys follow from the key, so the manifest and every chunk a
+    value of up to max_length bytes could have are read in a single
+    get_multi, rather than reading the manifest first. The chunks are
+    copied straight into one preallocated buffer.
+    - client: the memcache client to use
+    - max_length: the max number of bytes the value can have
+    - chunk_size: the max number of bytes in each chunk, as set_chunked
+    Return: the value as a bytearray, or None if the manifest or any of
+            the chunks are missing.
+    """
+    values = client.get_multi(
+        [key] + _chunk_keys(key, _num_chunks(max_length, chunk_size)))
+    manifest = values.get(key)
+    if manifest is None:
+        return None
+    num_chunks, length, checksum = [int(x) for x in manifest.split(':')]
+    if length > max_length:
+        raise RuntimeError("Chunked memcache value is longer than expected!")
+    chunk_keys = _chunk_keys(key, num_chunks)
+    if not all(chunk_key in values for chunk_key in chunk_keys):
+        # some of the chunks have been evicted
+        return None
+
+    data = bytearray(length)
+    view = memoryview(data)
+    position = 0
+    crc = 0
+    for chunk_key in chunk_keys:
+        chunk = values[chunk_key]
+        view[position:position + len(chunk)] = chunk
+        position += len(chunk)
+        crc = zlib.crc32(chunk, crc)
+    if position != length or crc & 0xffffffff != checksum:
+        raise RuntimeError("Chunked memcache value is corrupt!")
+    return data
+
+
+def delete_chunked(client, key, num_chunks):
+    """Delete a value set by set_chunked, and its chunks.
+
+    Return: whether the delete succeeded (as delete_multi).
+    """
+    return client.delete_multi([key] + _chunk_keys(key, num_chunks))
+
 
 def single(num_bytes):
     """Make a single request to memcache.
@@ -35,38 +146,41 @@ def single(num_bytes):
             and whether the data access succeeded.
     """
     # create the data and key
-    data = os.urandom(num_bytes)
+    data = payloads.get_bytes(num_bytes)
     key = 'profile_memcache_%s' % base64.b64encode(os.urandom(16))
     logging.debug("Profiling memcache for key %s" % key)
+    waits = []
 
-    # time set
-    set_start = time.time()
-    success = memcache.set(key, data)
-    set_end = time.time()
-    if not success:
-        raise RuntimeError("Memcache set failed!")
+    with borrow(waits) as memcache:
+        # time set
+        set_start = time.time()
+        success = memcache.set(key, data)
+        set_end = time.time()
+        if not success:
+            raise RuntimeError("Memcache set failed!")
 
-    # time get
-    get_start = time.time()
-    data_again = memcache.get(key)
-    get_end = time.time()
+        # time get
+        get_start = time.time()
+        data_again = memcache.get(key)
+        get_end = time.time()
 
-    if data != data_again:
-        logging.debug("data: %s" % data[:1000])
-        if isinstance(data_again, basestring):
-            logging.debug("data_again: %s" % data_again[:1000])
-        else:
-            logging.debug("data_again not a string: %s" % data_again)
+        if data != data_again:
+            logging.debug("data: %s" % data[:1000])
+            if isinstance(data_again, basestring):
+                logging.debug("data_again: %s" % data_again[:1000])
+            else:
+                logging.debug("data_again not a string: %s" % data_again)
 
-    # Time delete
-    delete_start = time.time()
-    memcache.delete(key)
-    delete_end = time.time()
+        # Time delete
+        delete_start = time.time()
+        memcache.delete(key)
+        delete_end = time.time()
 
     return {
         'get_time': get_end - get_start,
         'set_time': set_end - set_start,
         'del_time': delete_end - delete_start,
+        'pool_wait_time': sum(waits),
         'correct': data == data_again,
     }
 
@@ -74,36 +188,44 @@ def single(num_bytes):
 def threaded(num_bytes, num_threads):
     """Make multiple threads of get requests from memcache.
 
+    The gets are made by a process-wide pool of num_threads threads, so
+    the timing doesn't include starting the threads.
     - num_bytes: number of bytes to attach to the key
     - num_threads: number of gets to call (each in own thread)
-    Return: the time for the get operations,
-            and whether the data access succeeded.
+    Return: the time for all of the get operations to finish, the time
+            each get took, the number of gets per second, and whether
+            the data access succeeded.
     """
     # create and set the (key, data) pair
-    data = os.urandom(num_bytes)
+    data = payloads.get_bytes(num_bytes)
     key = 'profile_memcache_%s' % base64.b64encode(os.urandom(16))
     logging.debug("Profiling memcache for key %s" % key)
-    success = memcache.set(key, data)
+    with borrow() as memcache:
+        success = memcache.set(key, data)
     if not success:
         raise RuntimeError("Memcache set failed!")
 
-    # create the queue
-    queue = Queue.Queue()
+    # get the process-wide pool of threads to make the gets in
+    pool = workers.get_pool(num_threads)
+
+    # define the function to run in each thread (each thread borrows
+    # its own client, so the gets don't contend for one)
+    waits = []
 
-    # define the function to run
     def getter():
-        queue.put(memcache.get(key))
+        with borrow(waits) as memcache:
+            start = time.time()
+            value = memcache.get(key)
+            return value, time.time() - start
 
-    # time the get operations
+    # time the get operations, waiting for all of them to finish
     get_start = time.time()
-    # call getter() in multiple threads
-    for _ in xrange(num_threads):
-        threading.Thread(target=getter).start()
-    # extract the result from the queue
-    data_again = queue.get()
+    results = pool.map(getter, [()] * num_threads)
     get_end = time.time()
 
-    if data != data_again:
+    correct = all(data_again == data for (data_again, _) in results)
+    if not correct:
+        data_again = next(d for (d, _) in results if d != data)
         logging.debug("data: %s" % data[:1000])
         if isinstance(data_again, basestring):
             logging.debug("data_again: %s" % data_again[:1000])
@@ -111,10 +233,15 @@ def threaded(num_bytes, num_threads):
             logging.debug("data_again not a string: %s" % data_again)
 
     # delete the key
-    memcache.delete(key)
+    with borrow() as memcache:
+        memcache.delete(key)
     return {
         'get_time': get_end - get_start,
-        'correct': data == data_again,
+        'get_times': [t for (_, t) in results],
+        'ops_per_sec': num_threads / (get_end - get_start),
+        'pool_wait_time': sum(waits),
+        'pool_wait_times': waits,
+        'correct': correct,
     }
 
 
@@ -129,31 +256,465 @@ def multi(num_bytes, num_vals):
     # create the data and set to memcache
     data = {
         'profile_memcache_%s' % base64.b64encode(os.urandom(16)):
-        os.urandom(num_bytes)
+        payloads.get_bytes(num_bytes)
         for _ in range(num_vals)}
-    # time set
-    set_start = time.time()
-    failures = memcache.set_multi(data)
-    set_end = time.time()
+    waits = []
+
+    with borrow(waits) as memcache:
+        # time set
+        set_start = time.time()
+        failures = memcache.set_multi(data)
+        set_end = time.time()
+        if failures:
+            logging.debug("Failures: %s" % failures)
+            raise RuntimeError("Memcache set failed!")
+
+        # time get
+        get_start = time.time()
+        data_again = memcache.get_multi(data.keys())
+        get_end = time.time()
+
+        # time delete
+        delete_start = time.time()
+        success = memcache.delete_multi(data.keys())
+        delete_end = time.time()
+        if not success:
+            raise RuntimeError("Memcache delete failed!")
+
+    return {
+        'get_time': get_end - get_start,
+        'set_time': set_end - set_start,
+        'del_time': delete_end - delete_start,
+        'pool_wait_time': sum(waits),
+        'correct': data == data_again,
+    }
+
+
+def repeated(num_bytes, num_gets, sleep):
+    """Make multiple async get requests to the same key in memcache.
+
+    This is the Flex version of repeated() on Standard: all the gets are
+    sent at once (each on its own pooled connection), and we wait for them
+    with a poll() loop rather than blocking on each in turn.
+    - num_bytes: number of bytes to attach to the key
+    - num_gets: number of async get requests to make
+    - sleep: whether to sleep while polling for finished gets
+    Return: the time for the first get to finish, the time for all of
+            them to finish, and whether the data access succeeded.
+    """
+    # create and set the data
+    data = payloads.get_bytes(num_bytes)
+    key = 'profile_memcache_%s' % base64.b64encode(os.urandom(16))
+    logging.debug("Profiling memcache for key %s" % key)
+    with borrow() as memcache:
+        success = memcache.set(key, data)
+    if not success:
+        raise RuntimeError("Memcache set failed!")
+
+    # time get
+    values, times = async_client.get_many([key] * num_gets, sleep)
+    data_again = values[times.index(min(times))]
+
+    # check correctness of get
+    if data != data_again:
+        logging.debug("data: %s" % data[:1000])
+        if isinstance(data_again, basestring):
+            logging.debug("data_again: %s" % data_again[:1000])
+        else:
+            logging.debug("data_again not a string: %s" % data_again)
+
+    # delete data
+    with borrow() as memcache:
+        success = memcache.delete(key)
+    if not success:
+        raise RuntimeError("Memcache delete failed!")
+
+    return {
+        'get_time': min(times),
+        'get_all_time': max(times),
+        'correct': data == data_again,
+    }
+
+
+def repeated_unique(num_bytes, num_gets, sleep):
+    """Make multiple async get requests to different keys in memcache.
+
+    This is the Flex version of repeated_unique() on Standard (see
+    repeated()).
+    - num_bytes: number of bytes to attach to each key
+    - num_gets: number of keys to set
+    - sleep: whether to sleep while polling for finished gets
+    Return: the time for the first get to finish, the time for all of
+            them to finish, and whether the data access succeeded.
+    """
+    # create and set the data
+    data = payloads.get_bytes(num_bytes)
+    keys = ['profile_memcache_%s' % base64.b64encode(os.urandom(16))
+            for _ in xrange(num_gets)]
+    with borrow() as memcache:
+        failures = memcache.set_multi({key: data for key in keys})
     if failures:
         logging.debug("Failures: %s" % failures)
         raise RuntimeError("Memcache set failed!")
 
     # time get
-    get_start = time.time()
-    data_again = memcache.get_multi(data.keys())
-    get_end = time.time()
+    values, times = async_client.get_many(keys, sleep)
+    data_again = values[times.index(min(times))]
+
+    # check correctness of get
+    if data != data_again:
+        logging.debug("data: %s" % data[:1000])
+        if isinstance(data_again, basestring):
+            logging.debug("data_again: %s" % data_again[:1000])
+        else:
+            logging.debug("data_again not a string: %s" % data_again)
 
-    # time delete
-    delete_start = time.time()
-    success = memcache.delete_multi(data.keys())
-    delete_end = time.time()
+    # delete data
+    with borrow() as memcache:
+        success = memcache.delete_multi(keys)
     if not success:
         raise RuntimeError("Memcache delete failed!")
 
     return {
+        'get_time': min(times),
+        'get_all_time': max(times),
+        'correct': data == data_again,
+    }
+
+
+def compressed(num_bytes, mode, level, threshold, compressible):
+    """Make a single request to memcache, compressing the value.
+
+    The time to compress and decompress the value is reported separately
+    from the time to set and get it. In pylibmc mode the compression
+    happens inside set() and get(), so it's counted in their times.
+    - num_bytes: number of bytes to attach to the key
+    - mode: 'none', 'zlib' (we compress the value ourselves), or
+      'pylibmc' (pylibmc compresses values of at least threshold bytes
+      inside set(), with its min_compress_len option)
+    - level: the zlib compression level (1-9) in zlib mode
+    - threshold: the min number of bytes to compress a value
+    - compressible: whether to use text-like data instead of random bytes
+    Return: the time for compress, decompress, set, get, and delete
+            operations, the number of bytes stored, and whether the data
+            access succeeded.
+    """
+    if mode not in ('none', 'zlib', 'pylibmc'):
+        raise ValueError("Unknown compression mode: %s" % mode)
+
+    # create the data and key
+    data = (payloads.get_compressible(num_bytes) if compressible
+            else payloads.get_bytes(num_bytes))
+    key = 'profile_memcache_%s' % base64.b64encode(os.urandom(16))
+    logging.debug("Profiling memcache for key %s" % key)
+    compress = (mode == 'zlib' and num_bytes >= threshold)
+    waits = []
+
+    # time compress
+    compress_start = time.time()
+    value = zlib.compress(data, level) if compress else data
+    compress_end = time.time()
+
+    with borrow(waits) as memcache:
+        # time set
+        set_start = time.time()
+        if mode == 'pylibmc':
+            success = memcache.set(key, value,
+                                   min_compress_len=max(threshold, 1))
+        else:
+            success = memcache.set(key, value)
+        set_end = time.time()
+        if not success:
+            raise RuntimeError("Memcache set failed!")
+
+        # time get
+        get_start = time.time()
+        value_again = memcache.get(key)
+        get_end = time.time()
+
+        # time delete
+        delete_start = time.time()
+        memcache.delete(key)
+        delete_end = time.time()
+
+    # time decompress
+    decompress_start = time.time()
+    data_again = (zlib.decompress(value_again) if compress and value_again
+                  else value_again)
+    decompress_end = time.time()
+
+    return {
+        'compress_time': compress_end - compress_start,
+        'decompress_time': decompress_end - decompress_start,
         'get_time': get_end - get_start,
         'set_time': set_end - set_start,
         'del_time': delete_end - delete_start,
+        'pool_wait_time': sum(waits),
+        # (pylibmc doesn't tell us how big the value it stored was)
+        'stored_bytes': None if mode == 'pylibmc' else len(value),
         'correct': data == data_again,
     }
+
+
+def chunked(num_bytes):
+    """Make a single request to memcache, with the value split into chunks.
+
+    This works for values bigger than memcache's item limit (see
+    set_chunked).
+    - num_bytes: number of bytes to attach to the key
+    Return: the time for the get, set, and delete operations, the number
+            of chunks, and whether the data access succeeded.
+    """
+    # create the data and key
+    data = payloads.get_bytes(num_bytes)
+    key = 'profile_memcache_%s' % base64.b64encode(os.urandom(16))
+    logging.debug("Profiling memcache for key %s" % key)
+    num_chunks = _num_chunks(num_bytes)
+    waits = []
+
+    with borrow(waits) as memcache:
+        # time set
+        set_start = time.time()
+        failures = set_chunked(memcache, key, data)
+        set_end = time.time()
+        if failures:
+            logging.debug("Failures: %s" % failures)
+            raise RuntimeError("Memcache set failed!")
+
+        # time get
+        get_start = time.time()
+        data_again = get_chunked(memcache, key, num_bytes)
+        get_end = time.time()
+
+        # time delete
+        delete_start = time.time()
+        success = delete_chunked(memcache, key, num_chunks)
+        delete_end = time.time()
+        if not success:
+            raise RuntimeError("Memcache delete failed!")
+
+    return {
+        'get_time': get_end - get_start,
+        'set_time': set_end - set_start,
+        'del_time': delete_end - delete_start,
+        'pool_wait_time': sum(waits),
+        'chunks': num_chunks,
+        'correct': data_again is not None and data == data_again,
+    }
+
+
+def coalesced(num_bytes, num_threads, num_vals, window, max_batch):
+    """Make gets from many threads at once, coalesced into get_multis.
+
+    The same gets are made plainly first, each with its own get, to
+    compare against.
+    - num_bytes: number of bytes to attach to each key
+    - num_threads: number of gets to call at once (each in own thread)
+    - num_vals: number of distinct keys to spread the gets across
+    - window: number of seconds the coalescer waits to batch gets
+    - max_batch: max number of gets the coalescer batches together
+    Return: the time for all of the coalesced gets to finish, the time
+            each one took, and the number per second; the same for the
+            plain gets; the number of get_multis and the mean number of
+            gets in each; and whether the data access succeeded.
+    """
+    # create and set the (key, data) pairs
+    values = {}
+    for _ in xrange(num_vals):
+        key = 'profile_memcache_%s' % base64.b64encode(os.urandom(16))
+        values[key] = payloads.get_bytes(num_bytes)
+    logging.debug("Profiling memcache for %s keys" % num_vals)
+    # spread the gets evenly across the keys
+    keys = values.keys()
+    keys = [keys[i % num_vals] for i in xrange(num_threads)]
+    with borrow() as memcache:
+        failures = memcache.set_multi(values)
+    if failures:
+        logging.debug("Failures: %s" % failures)
+        raise RuntimeError("Memcache set failed!")
+
+    # get the process-wide pool of threads to make the gets in
+    pool = workers.get_pool(num_threads)
+
+    # each thread borrows its own client for its plain get, and the
+    # coalescer borrows one for each get_multi
+    def plain_getter(key):
+        with borrow() as memcache:
+            start = time.time()
+            value = memcache.get(key)
+            return value, time.time() - start
+
+    def get_multi(keys):
+        with borrow() as memcache:
+            return memcache.get_multi(keys)
+
+    batcher = coalescer.Coalescer(get_multi, window, max_batch)
+
+    def coalesced_getter(key):
+        start = time.time()
+        value = batcher.get(key)
+        return value, time.time() - start
+
+    # time the plain gets, and then the coalesced gets
+    plain_start = time.time()
+    plain_results = pool.map(plain_getter, [(k,) for k in keys])
+    plain_end = time.time()
+
+    get_start = time.time()
+    results = pool.map(coalesced_getter, [(k,) for k in keys])
+    get_end = time.time()
+
+    # delete the keys
+    with borrow() as memcache:
+        memcache.delete_multi(values.keys())
+
+    correct = all(data_again == values[key]
+                  for (key, (data_again, _)) in zip(keys + keys,
+                                                    results + plain_results))
+    return {
+        'get_time': get_end - get_start,
+        'get_times': [t for (_, t) in results],
+        'ops_per_sec': num_threads / (get_end - get_start),
+        'plain_get_time': plain_end - plain_start,
+        'plain_get_times': [t for (_, t) in plain_results],
+        'plain_ops_per_sec': num_threads / (plain_end - plain_start),
+        'batches': batcher.batches,
+        'mean_batch_size': float(num_threads) / batcher.batches,
+        'correct': correct,
+    }
+
+
+def _read_through(cache, memcache, reads):
+    """Make the reads through the local cache, and then straight to memcache.
+
+    Return: (value, time, whether it was a local hit) for each cached
+            read, and (value, time) for each direct read.
+    """
+    cached_results = []
+    for key in reads:
+        hits = cache.hits
+        start = time.time()
+        value = cache.get(key)
+        cached_results.append((value, time.time() - start, cache.hits > hits))
+
+    direct_results = []
+    for key in reads:
+        start = time.time()
+        value = memcache.get(key)
+        direct_results.append((value, time.time() - start))
+    return cached_results, direct_results
+
+
+def local_cached(num_bytes, num_vals, num_gets, max_bytes, ttl):
+    """Make repeated reads through an in-process cache in front of memcache.
+
+    The same reads are made straight to memcache too, to compare against.
+    - num_bytes: number of bytes to attach to each key
+    - num_vals: number of distinct keys to read
+    - num_gets: number of reads to make (of keys picked at random)
+    - max_bytes: max number of bytes the local cache holds
+    - ttl: number of seconds local entries live for (None for no limit)
+    Return: the time for all of the cached reads, the mean time of the
+            local hits and of the misses, the time for all of the direct
+            reads, the hit ratio, the memory use of the cache, and whether
+            the data access succeeded.
+    """
+    # create the (key, data) pairs and the reads to make of them
+    values = {}
+    for _ in xrange(num_vals):
+        key = 'profile_memcache_%s' % base64.b64encode(os.urandom(16))
+        values[key] = payloads.get_bytes(num_bytes)
+    logging.debug("Profiling memcache for %s keys" % num_vals)
+    keys = values.keys()
+    reads = [random.choice(keys) for _ in xrange(num_gets)]
+
+    with borrow() as memcache:
+        failures = memcache.set_multi(values)
+        if failures:
+            logging.debug("Failures: %s" % failures)
+            raise RuntimeError("Memcache set failed!")
+
+        cache = local_cache.LocalCache(memcache, max_bytes, ttl)
+        cached_results, direct_results = _read_through(cache, memcache,
+                                                       reads)
+        memcache.delete_multi(values.keys())
+
+    hit_times = [t for (_, t, hit) in cached_results if hit]
+    miss_times = [t for (_, t, hit) in cached_results if not hit]
+    stats = cache.stats()
+    correct = all(data_again == values[key] for (key, (data_again, _, _))
+                  in zip(reads, cached_results))
+    correct = correct and all(data_again == values[key]
+                              for (key, (data_again, _))
+                              in zip(reads, direct_results))
+    return {
+        'get_time': sum(t for (_, t, _) in cached_results),
+        'local_hit_time': (sum(hit_times) / len(hit_times)
+                           if hit_times else None),
+        'miss_time': sum(miss_times) / len(miss_times) if miss_times else None,
+        'direct_get_time': sum(t for (_, t) in direct_results),
+        'hit_ratio': stats['hit_ratio'],
+        'evictions': stats['evictions'],
+        'cache_entries': stats['entries'],
+        'cache_bytes': stats['bytes'],
+        'correct': correct,
+    }
+
+
+def _run_ops(memcache, ops, num_bytes):
+    """Make a workload's operations, reads as gets and writes as sets.
+
+    Return: (whether it's a write, whether it succeeded, time) for each
+            operation (a read succeeds if the key was there).
+    """
+    results = []
+    for (is_write, key) in ops:
+        start = time.time()
+        if is_write:
+            success = memcache.set(key, payloads.get_bytes(num_bytes))
+        else:
+            success = memcache.get(key) is not None
+        results.append((is_write, success, time.time() - start))
+    return results
+
+
+def mixed(num_bytes, num_ops, workload):
+    """Make a mix of gets and sets of keys drawn from a persistent keyspace.
+
+    The keys are left in memcache for later requests, so reads of keys
+    that were written (and haven't been evicted) hit.
+    - num_bytes: number of bytes to attach to each key written
+    - num_ops: number of operations to make
+    - workload: the workload.Workload to draw the operations from
+    Return: the total and mean time for the gets and for the sets, the
+            number of operations per second, the fraction of gets that
+            hit, the number of distinct keys used, and whether the sets
+            succeeded. The means are None if there were no gets (or sets).
+    """
+    ops = workload.ops(num_ops)
+    logging.debug("Profiling memcache for %s ops" % num_ops)
+
+    start = time.time()
+    with borrow() as memcache:
+        results = _run_ops(memcache, ops, num_bytes)
+    end = time.time()
+
+    get_times = [t for (is_write, _, t) in results if not is_write]
+    set_times = [t for (is_write, _, t) in results if is_write]
+    hits = sum(1 for (is_write, success, _) in results
+               if success and not is_write)
+    return {
+        'get_time': sum(get_times, 0.0),
+        'set_time': sum(set_times, 0.0),
+        'mean_get_time': (sum(get_times) / len(get_times) if get_times
+                          else None),
+        'mean_set_time': (sum(set_times) / len(set_times) if set_times
+                          else None),
+        'ops_per_sec': num_ops / (end - start),
+        'hit_ratio': float(hits) / len(get_times) if get_times else None,
+        'reads': len(get_times),
+        'writes': len(set_times),
+        'distinct_keys': len(set(key for (_, key) in ops)),
+        'correct': all(success for (is_write, success, _) in results
+                       if is_write),
+    }
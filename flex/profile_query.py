@@ -0,0 +1,159 @@
+"""Some functions for profiling datastore queries.
+
+Each dataset (of a given number of entities, with a given number of bytes
+of unindexed payload each) lives in its own namespace, and is only seeded
+the first time it's queried, so later requests query a warm dataset. Entity
+i has rank i and is in group i % NUM_GROUPS.
+"""
+import random
+import time
+
+import google.cloud.datastore
+
+import payloads
+import profile_datastore
+
+# the number of distinct values of the group property
+NUM_GROUPS = 10
+
+# the number of entities to put in each call when seeding a dataset
+SEED_BATCH_SIZE = 500
+
+# the kinds of query we can profile
+MODES = ('eq', 'range', 'projection', 'keys_only', 'cursor')
+
+
+def _namespace(num_entities, num_bytes):
+    """Get the namespace of a dataset."""
+    return 'profile_query_%d_%d' % (num_entities, num_bytes)
+
+
+def _check(mode, num_entities, limit, group, start, ranks):
+    """Check that a query returned the entities it should have.
+
+    - group: the group an eq or keys_only query filtered on
+    - start: the first rank a range query filtered on
+    - ranks: the ranks of the entities returned (or their names, for a
+      projection query)
+    """
+    if mode == 'range':
+        return ranks == range(start, min(start + limit, num_entities))
+    elif mode == 'cursor':
+        return ranks == range(min(limit, num_entities))
+    elif mode == 'projection':
+        return len(ranks) == min(limit, num_entities)
+    else:
+        # the entities come back in key order, not rank order
+        in_group = len(xrange(group, num_entities, NUM_GROUPS))
+        return (len(ranks) == min(limit, in_group) and
+                all(rank % NUM_GROUPS == group for rank in ranks))
+
+
+def _seed(ds, num_entities, num_bytes):
+    """Put a dataset's entities, if they're not there already.
+
+    Return: the time it took to seed them, or None if they were there.
+    """
+    namespace = _namespace(num_entities, num_bytes)
+
+    def key(i):
+        return ds.key('QueryModel', 'row%d' % i, namespace=namespace)
+
+    # the entities are put in order, so the last one is there only if
+    # they all are
+    if ds.get(key(num_entities - 1)) is not None:
+        return None
+
+    start = time.time()
+    for batch_start in xrange(0, num_entities, SEED_BATCH_SIZE):
+        entities = []
+        for i in xrange(batch_start,
+                        min(batch_start + SEED_BATCH_SIZE, num_entities)):
+            entities.append(google.cloud.datastore.Entity(
+                key=key(i), exclude_from_indexes=('payload',)))
+            entities[-1].update({
+                'group': i % NUM_GROUPS,
+                'rank': i,
+                'name': 'name%d' % i,
+                'payload': payloads.get_text(num_bytes),
+            })
+        ds.put_multi(entities)
+    return time.time() - start
+
+
+def query_datastore(num_entities, num_bytes, mode, limit, page_size):
+    """Make a query against a persistent dataset.
+
+    - num_entities: number of entities in the dataset
+    - num_bytes: number of bytes of (unindexed) payload in each entity
+    - mode: the kind of query to make:
+      eq: entities of a random group (an equality filter)
+      range: entities with a rank in a random range (a range filter)
+      projection: the name of any entities (a projection query)
+      keys_only: keys of entities of a random group (an equality filter)
+      cursor: entities in rank order, a page at a time
+    - limit: the max number of results to get
+    - page_size: the number of results in each page, for cursor
+    Return: the time for the query (and for each page, for cursor), the
+            number of results, the time to seed the dataset (if this
+            request did), and whether the right results were returned.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown query mode: %s" % mode)
+
+    ds = profile_datastore.get_client()
+    seed_time = _seed(ds, num_entities, num_bytes)
+    query = ds.query(kind='QueryModel',
+                     namespace=_namespace(num_entities, num_bytes))
+    group = random.randrange(NUM_GROUPS)
+    start = random.randrange(num_entities)
+    page_times = []
+
+    # set up the query
+    if mode in ('eq', 'keys_only'):
+        query.add_filter('group', '=', group)
+    if mode == 'keys_only':
+        query.keys_only()
+    elif mode == 'range':
+        query.add_filter('rank', '>=', start)
+        query.add_filter('rank', '<', start + limit)
+    elif mode == 'projection':
+        query.projection = ['name']
+    elif mode == 'cursor':
+        query.order = ['rank']
+
+    # time query
+    query_start = time.time()
+    if mode != 'cursor':
+        results = list(query.fetch(limit=limit))
+    else:
+        results = []
+        cursor = None
+        while len(results) < limit:
+            page_start = time.time()
+            iterator = query.fetch(limit=min(page_size, limit - len(results)),
+                                   start_cursor=cursor)
+            page = list(next(iterator.pages))
+            page_times.append(time.time() - page_start)
+            if not page:
+                break
+            results.extend(page)
+            cursor = iterator.next_page_token
+            if cursor is None:
+                break
+    query_end = time.time()
+
+    if mode == 'projection':
+        ranks = [r['name'] for r in results]
+    elif mode == 'keys_only':
+        ranks = [int(r.key.name[len('row'):]) for r in results]
+    else:
+        ranks = [r['rank'] for r in results]
+
+    return {
+        'get_time': query_end - query_start,
+        'page_times': page_times,
+        'results': len(results),
+        'seed_time': seed_time,
+        'correct': _check(mode, num_entities, limit, group, start, ranks),
+    }
@@ -14,80 +14,461 @@ Each row in the CSV file should consist of the following columns:
 - del_time (the latency of delete in ms)
 - get_time (the latency of get in ms)
 - set_time (the latency of set/put in ms)
+- intended_start, actual_start (when the request should have been sent and
+  when it was actually sent, in ms from the start of the param set)
+- queue_time (how long the request waited to be sent, in ms)
+- rtt (the round-trip time of the request as seen by the client, in ms)
+- handler_time (the time the app spent handling the request, in ms)
+- network_time (rtt - handler_time, in ms)
+- framework_time (handler_time minus the del/get/set times, in ms)
+
+Files written before these columns existed are still supported: columns
+missing from a file are skipped, as are blank values.
 
 View test.py to see how the requests are made.
+
+With --streaming, the files are instead read a chunk at a time into a
+mergeable sketch (see sketch.py) per (type, endpoint, params, operation),
+so memory use doesn't grow with the number of samples. The sketches can be
+saved with --save-sketches and merged into a later analysis with
+--load-sketches, without re-reading the raw data.
+
+Otherwise, the parsed data of each file is cached in a binary file next to
+it (see DataFile.load), so analyzing the same files again is fast.
 """
 
 import argparse
 import csv
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import warnings
 
 import numpy as np
 
+import sketch
+
 
 # the percentiles we want to extract from the data
 PERCENTILES = [10.0, 50.0, 90.0, 95.0, 99.0]
 # the sets of params that we want to extract percentiles from
 PARAM_SETS = ["{'bytes': 10000}", "{'bytes': 100000}"]
 # the columns in the data that we want to extract percentiles from
-DATA_COLUMNS = ['get_time (ms)', 'set_time (ms)', 'del_time (ms)']
+DATA_COLUMNS = ['get_time (ms)', 'set_time (ms)', 'del_time (ms)',
+                'queue_time (ms)', 'rtt (ms)', 'handler_time (ms)',
+                'network_time (ms)', 'framework_time (ms)']
 # the columns to write to the output file
 OUTPUT_COLUMNS = ['GAE', 'endpoint', 'timestamp', 'operation', 'params',
                   'percentile', 'value']
 
 
+# the suffix of the sidecar cache written next to each data file
+CACHE_SUFFIX = '.cache.npz'
+# the version of the cache format (bump this when it changes)
+CACHE_VERSION = 1
+# the default max total size of the caches in a directory, in MB
+CACHE_LIMIT_MB = 1024
+
+
 class DataFile(object):
-    """An object for extracting data from CSV files."""
+    """An object for extracting data from CSV files.
+
+    The data columns are stored as one 2-D float array (a row per sample,
+    a column per data column), sorted by param set so that the samples for
+    each param set are a contiguous block of rows. The params and type of
+    each sample are stored as integer codes into the lists of distinct
+    values.
+    """
+
+    # the number of rows to read at once
+    CHUNK_SIZE = 1 << 16
 
     def __init__(self, filename):
-        """Parse the csv file into an array of data."""
+        """Parse the csv file into columns of data, grouped by params.
+
+        The csv module splits the rows (the params column is quoted and
+        may have commas in it, which np.genfromtxt can't handle), and then
+        each chunk of rows is transposed and converted a whole column at a
+        time, so there's no per-row work in Python.
+        """
         with open(filename, 'rb') as f:
-            reader = csv.DictReader(f)
-            self.rows = list(reader)
+            reader = csv.reader(f)
+            self.columns = next(reader)
+            # the data columns this file has, in the order of the array
+            self.data_columns = [c for c in DATA_COLUMNS
+                                 if c in self.columns]
+            data_idx = [self.columns.index(c) for c in self.data_columns]
+            params_idx = self.columns.index('params')
+            type_idx = self.columns.index('type')
+
+            params, types, chunks = [], [], []
+            self.endpoint = self.timestamp = None
+            while True:
+                rows = list(itertools.islice(reader, self.CHUNK_SIZE))
+                if not rows:
+                    break
+                if self.endpoint is None:
+                    # all rows have the same endpoint (and ~ the same time)
+                    self.endpoint = rows[0][self.columns.index('request_url')]
+                    self.timestamp = rows[0][self.columns.index('timestamp')]
+                columns = zip(*rows)
+                params.append(np.array(columns[params_idx]))
+                types.append(np.array(columns[type_idx]))
+                # Blank values (from apps that don't report them) are NaN.
+                strings = np.array([columns[i] for i in data_idx]).T
+                chunk = np.full(strings.shape, np.nan)
+                filled = strings != ''
+                chunk[filled] = strings[filled].astype(np.float64)
+                chunks.append(chunk)
+
+        # the distinct params/types (as strings, in the order they first
+        # appear), and the code of each row's params/type
+        self.params, param_codes = _encode(params)
+        self.types, self.type_codes = _encode(types)
+        # all rows have the same type
+        self.type = self.types[self.type_codes[0]] if self.types else None
+
+        # sort the samples by param set, and remember where each starts
+        order = np.argsort(param_codes, kind='mergesort')
+        self.data = (np.concatenate(chunks)[order] if chunks else
+                     np.empty((0, len(self.data_columns))))
+        self._build_index(np.cumsum(np.bincount(
+            param_codes, minlength=len(self.params))))
+
+    def _build_index(self, ends):
+        """Map each param set to its (start, end) rows in the data.
+
+        - ends: the (exclusive) end row of each param set, in the order
+          of self.params
+        """
+        starts = [0] + [int(e) for e in ends[:-1]]
+        self.index = {p: (start, int(end)) for (p, start, end) in
+                      zip(self.params, starts, ends)}
+
+    @classmethod
+    def load(cls, filename, use_cache=True):
+        """Load a csv file, from its sidecar cache if that's up to date.
+
+        The first time a file is loaded, the parsed data is written to a
+        binary file next to it (see CACHE_SUFFIX), which later loads read
+        directly instead of parsing the csv file again. The cache is
+        ignored (and rewritten) if the csv file's size or modification
+        time has changed since.
+        """
+        if use_cache:
+            data = cls._read_cache(filename)
+            if data is not None:
+                return data
+        data = cls(filename)
+        if use_cache:
+            try:
+                data._write_cache(filename)
+            except (IOError, OSError):
+                logging.exception('Could not cache %s' % filename)
+        return data
+
+    @classmethod
+    def _read_cache(cls, filename):
+        """Read a csv file's sidecar cache, or None if it's out of date."""
+        cache_file = filename + CACHE_SUFFIX
+        if not os.path.exists(cache_file):
+            return None
+        stat = os.stat(filename)
+        try:
+            cached = np.load(cache_file)
+            if (int(cached['version']) != CACHE_VERSION or
+                    int(cached['source_size']) != stat.st_size or
+                    float(cached['source_mtime']) != stat.st_mtime):
+                return None
+            data = cls.__new__(cls)
+            data.columns = list(cached['columns'])
+            data.data_columns = list(cached['data_columns'])
+            data.params = list(cached['params'])
+            data.types = list(cached['types'])
+            data.type, data.endpoint, data.timestamp = [
+                str(x) if x else None for x in cached['metadata']]
+            data.data = cached['data']
+            data._build_index(cached['ends'])
+        except Exception:
+            # a cache we can't read is as good as no cache
+            logging.exception('Could not read cache %s' % cache_file)
+            return None
+        # mark the cache as recently used (see prune_cache)
+        os.utime(cache_file, None)
+        return data
+
+    def _write_cache(self, filename):
+        """Write the sidecar cache of the csv file this was parsed from."""
+        stat = os.stat(filename)
+        cache_file = filename + CACHE_SUFFIX
+        # write to a temporary file first, so that a reader never sees
+        # a half-written cache
+        with open(cache_file + '.tmp', 'wb') as f:
+            np.savez(f,
+                     version=CACHE_VERSION,
+                     source_size=stat.st_size,
+                     source_mtime=stat.st_mtime,
+                     columns=np.array(self.columns, dtype=str),
+                     data_columns=np.array(self.data_columns, dtype=str),
+                     params=np.array(self.params, dtype=str),
+                     types=np.array(self.types, dtype=str),
+                     metadata=np.array([self.type or '', self.endpoint or '',
+                                        self.timestamp or ''], dtype=str),
+                     data=self.data,
+                     ends=np.array([self.index[p][1] for p in self.params],
+                                   dtype=np.int64))
+        os.rename(cache_file + '.tmp', cache_file)
+
+    def get_group(self, params):
+        """Get the block of data rows for a given param set."""
+        # Note that we take str(params) because the params are stored
+        # as a string in the original data file.
+        start, end = self.index.get(str(params), (0, 0))
+        return self.data[start:end]
 
     def get_column(self, params, col_name):
         """Extract a given column from the data matching a given param set."""
-        # Extract the column. Note that we take str(params) because
-        # the params are stored as a string in the original data file.
-        column = [float(r[col_name]) for r in self.rows if
-                  r['params'] == str(params)]
+        column = self.get_group(params)[:, self.data_columns.index(col_name)]
+        column = column[~np.isnan(column)]
         print('extracting column %s with %s samples\n' %
               (col_name, len(column)))
         return column
 
+    def get_percentiles(self, params, percentiles):
+        """Get the desired percentiles of every data column for a param set.
+
+        Return: a dict from column name to a dict from percentile to value,
+                for the columns with any values for this param set.
+        """
+        group = self.get_group(params)
+        counts = np.sum(~np.isnan(group), axis=0)
+        for (j, col) in enumerate(self.data_columns):
+            print('extracting column %s with %s samples\n' %
+                  (col, counts[j]))
+        if not len(group):
+            return {}
+
+        # one call for all of the columns; blank values are ignored
+        with warnings.catch_warnings():
+            # columns without any values give an all-NaN slice
+            warnings.simplefilter('ignore', RuntimeWarning)
+            values = np.nanpercentile(group, percentiles, axis=0)
+        return {col: dict(zip(percentiles, values[:, j]))
+                for (j, col) in enumerate(self.data_columns) if counts[j]}
+
+
+def _encode(chunks):
+    """Encode a column of strings as codes into its distinct values.
+
+    - chunks: the column, as a list of arrays of strings
+    Return: the distinct values (in the order they first appear), and the
+            code of each row.
+    """
+    if not chunks:
+        return [], np.empty(0, dtype=np.intp)
+    values, first, codes = np.unique(np.concatenate(chunks),
+                                     return_index=True, return_inverse=True)
+    # np.unique sorts the values, so renumber them by first appearance
+    order = np.argsort(first)
+    renumber = np.empty(len(order), dtype=np.intp)
+    renumber[order] = np.arange(len(order))
+    return [str(v) for v in values[order]], renumber[codes]
+
+
+def summarize_file(filename, param_sets, use_cache=True):
+    """Get the rows of the output file for a given data file."""
+    rows = []
+    # create a DataFile object from the file (or its cache)
+    data = DataFile.load(filename, use_cache)
+    # iterate through the param sets we seek
+    for p in param_sets:
+        # get the percentiles for every column at once
+        results = data.get_percentiles(p, PERCENTILES)
+        # iterate through the columns we're looking for (skipping
+        # those without any values for this param set)
+        for col in DATA_COLUMNS:
+            if col not in results:
+                continue
+            res = results[col]
+            for x in PERCENTILES:
+                rows.append([data.type, data.endpoint, data.timestamp,
+                             col, p, x, res[x]])
+    return rows
+
+
+def map_files(fn, args_list, jobs):
+    """Call fn on each tuple of args, in `jobs` worker processes.
 
-def get_percentiles(column, percentiles):
-    """Get the desired percentiles of a given dataset."""
-    return {p: np.percentile(column, p) for p in percentiles}
+    Return: the results, in the same order as args_list.
+    """
+    if jobs <= 1:
+        return [fn(args) for args in args_list]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(fn, args_list, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
 
 
-def output_results(output_file, data_files, param_sets):
-    """Print the results."""
+def _summarize_file(args):
+    """Call summarize_file from a worker process, which takes one arg."""
+    return summarize_file(*args)
+
+
+def prune_cache(directories, limit_bytes):
+    """Delete the least recently used caches over a total size limit.
+
+    - directories: the directories to look for caches in
+    - limit_bytes: the max total size of the caches in those directories
+    """
+    caches = []
+    for directory in directories:
+        for name in os.listdir(directory):
+            if name.endswith(CACHE_SUFFIX):
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                caches.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for (_, size, _) in caches)
+    # delete the oldest first
+    for (_, size, path) in sorted(caches):
+        if total <= limit_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def output_results(output_file, data_files, param_sets, jobs=1,
+                   use_cache=True, cache_limit_mb=CACHE_LIMIT_MB):
+    """Print the results.
+
+    - jobs: the number of processes to parse the data files in
+    - use_cache: whether to read and write the sidecar cache of each file
+    - cache_limit_mb: the max total size of the caches in each directory
+    """
+    # parse and summarize the files (in parallel, if we have the jobs)
+    summaries = map_files(_summarize_file,
+                          [(f, param_sets, use_cache) for f in data_files],
+                          jobs)
+    if use_cache:
+        prune_cache({os.path.dirname(os.path.abspath(f))
+                     for f in data_files},
+                    cache_limit_mb * 1024 * 1024)
     with open(output_file, 'wb') as file:
         # set up the writer
         wr = csv.writer(file)
         wr.writerow(OUTPUT_COLUMNS)
-        # iterate through the data files
-        for file in data_files:
-            # create a DataFile object from the file
-            data = DataFile(file)
-            # iterate through the param sets we seek
+        # write out the percentiles to analysis.csv, in the order of
+        # the data files
+        for rows in summaries:
+            wr.writerows(rows)
+
+
+def stream_file(filename, relative_error, sketches):
+    """Feed the data columns of a csv file into latency sketches.
+
+    The file is read a chunk of rows at a time, so memory use doesn't grow
+    with the size of the file.
+    - relative_error: the relative error of any new sketches
+    - sketches: a dict from (type, endpoint, params, operation) to a
+      [timestamp, LatencySketch] pair, which is updated in place
+    Return: the updated sketches.
+    """
+    with open(filename, 'rb') as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+        data_columns = [c for c in DATA_COLUMNS if c in columns]
+        data_idx = [columns.index(c) for c in data_columns]
+        key_idx = [columns.index(c) for c in ('type', 'request_url',
+                                              'params')]
+        timestamp_idx = columns.index('timestamp')
+        timestamp = None
+        while True:
+            rows = list(itertools.islice(reader, DataFile.CHUNK_SIZE))
+            if not rows:
+                break
+            if timestamp is None:
+                # all rows have ~ the same time, so use the file's first
+                # (as DataFile does)
+                timestamp = rows[0][timestamp_idx]
+            # group the rows of the chunk by (type, endpoint, params)
+            groups = {}
+            for (n, r) in enumerate(rows):
+                groups.setdefault(tuple(r[i] for i in key_idx), []).append(n)
+            data = np.array([[r[i] or 'nan' for i in data_idx]
+                             for r in rows]).astype(np.float64)
+            for (key, group) in groups.iteritems():
+                block = data[group]
+                for (j, col) in enumerate(data_columns):
+                    values = block[:, j]
+                    values = values[~np.isnan(values)]
+                    if not len(values):
+                        continue
+                    entry = sketches.get(key + (col,))
+                    if entry is None:
+                        entry = sketches[key + (col,)] = [
+                            timestamp, sketch.LatencySketch(relative_error)]
+                    entry[1].add_many(values)
+    return sketches
+
+
+def _stream_file(args):
+    """Stream a file into new sketches from a worker process."""
+    filename, relative_error = args
+    return stream_file(filename, relative_error, {})
+
+
+def merge_sketches(sketches, other):
+    """Merge one dict of sketches (see stream_file) into another."""
+    for (key, (timestamp, other_sketch)) in other.iteritems():
+        entry = sketches.get(key)
+        if entry is None:
+            sketches[key] = [timestamp, other_sketch]
+        else:
+            # keep the time of the earliest run
+            entry[0] = min(entry[0], timestamp)
+            entry[1].merge(other_sketch)
+    return sketches
+
+
+def save_sketches(filename, sketches):
+    """Write a dict of sketches (see stream_file) out as JSON."""
+    with open(filename, 'wb') as f:
+        json.dump([{'type': gae_type, 'endpoint': endpoint, 'params': params,
+                    'operation': col, 'timestamp': timestamp,
+                    'sketch': s.to_dict()}
+                   for ((gae_type, endpoint, params, col), (timestamp, s))
+                   in sorted(sketches.iteritems())], f)
+
+
+def load_sketches(filename):
+    """Read a dict of sketches written out by save_sketches."""
+    with open(filename, 'rb') as f:
+        return {(d['type'], d['endpoint'], d['params'], d['operation']):
+                [d['timestamp'], sketch.LatencySketch.from_dict(d['sketch'])]
+                for d in json.load(f)}
+
+
+def output_sketch_results(output_file, sketches, param_sets):
+    """Print the results from a dict of sketches (see stream_file)."""
+    with open(output_file, 'wb') as file:
+        # set up the writer
+        wr = csv.writer(file)
+        wr.writerow(OUTPUT_COLUMNS)
+        # iterate through the (type, endpoint) pairs we have data for
+        for (gae_type, endpoint) in sorted({k[:2] for k in sketches}):
             for p in param_sets:
-                # iterate through the columns we're looking for
                 for col in DATA_COLUMNS:
-                    # get the percentiles for this column
-                    res = get_percentiles(data.get_column(p, col),
-                                          PERCENTILES)
-                    # write out the percentiles to analysis.csv
+                    entry = sketches.get((gae_type, endpoint, str(p), col))
+                    if entry is None:
+                        continue
+                    timestamp, s = entry
                     for x in PERCENTILES:
-                        # get the type (all rows have the same type)
-                        gae_type = data.rows[0]['type']
-                        # get the endpoint (all rows have the same endpoint)
-                        endpoint = data.rows[0]['request_url']
-                        # get the timestamp (all rows have ~ the same time)
-                        timestamp = data.rows[0]['timestamp']
-                        # write the row
                         wr.writerow([gae_type, endpoint, timestamp,
-                                    col, p, x, res[x]])
+                                     col, p, x, s.percentile(x)])
+
 
 if __name__ == '__main__':
     PARAM_SETS = None  # no special parameter sets
@@ -101,7 +482,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Parse data for percentiles.')
 
     # add an argument for the input data files
-    parser.add_argument(dest='data_files', nargs='+',
+    parser.add_argument(dest='data_files', nargs='*',
                         help='The filenames of data to parse')
 
     # add an argument for the parameter sets to extract
@@ -119,6 +500,27 @@ if __name__ == '__main__':
     parser.add_argument('--output-file', '-o', default='./percentiles.csv',
                         help='The file to write the output to')
 
+    # add arguments for the streaming (sketch) mode
+    parser.add_argument('--streaming', '-s', action='store_true',
+                        help='Use sketches, in constant memory')
+    parser.add_argument('--relative-error', default=0.01, type=float,
+                        help='The relative error of the sketches')
+    parser.add_argument('--save-sketches',
+                        help='The file to save the sketches to')
+    parser.add_argument('--load-sketches', nargs='+', default=[],
+                        help='Sketch files from earlier runs to merge in')
+
+    # add arguments for the sidecar caches of the data files
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Don't read or write the cache of each file")
+    parser.add_argument('--cache-limit', default=CACHE_LIMIT_MB, type=int,
+                        help='The max total size of the caches in a '
+                             'directory, in MB')
+
+    # add an argument for the number of processes to parse files in
+    parser.add_argument('--jobs', '-j', default=1, type=int,
+                        help='The number of files to parse in parallel')
+
     # take input args
     args = parser.parse_args()
 
@@ -128,4 +530,21 @@ if __name__ == '__main__':
     if not PARAM_SETS:
         PARAM_SETS = [{'bytes': n} for n in args.num_bytes]
 
-    output_results(args.output_file, args.data_files, PARAM_SETS)
+    if args.streaming or args.save_sketches or args.load_sketches:
+        sketches = {}
+        for filename in args.load_sketches:
+            merge_sketches(sketches, load_sketches(filename))
+        # merge the sketches of each file in order, so that the
+        # output doesn't depend on which worker finished first
+        for file_sketches in map_files(
+                _stream_file,
+                [(f, args.relative_error) for f in args.data_files],
+                args.jobs):
+            merge_sketches(sketches, file_sketches)
+        if args.save_sketches:
+            save_sketches(args.save_sketches, sketches)
+        output_sketch_results(args.output_file, sketches, PARAM_SETS)
+    else:
+        output_results(args.output_file, args.data_files, PARAM_SETS,
+                       jobs=args.jobs, use_cache=not args.no_cache,
+                       cache_limit_mb=args.cache_limit)
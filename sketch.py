@@ -0,0 +1,136 @@
+"""A mergeable sketch of a latency distribution.
+
+Rather than keeping every sample around to take percentiles of (as
+parse_data.DataFile does), a LatencySketch counts the samples in
+logarithmically sized buckets. Every value in a bucket is within a fixed
+relative error of the bucket's representative value, so any percentile can
+be read back to within that error, using memory that grows with the log of
+the range of the values rather than with the number of samples.
+
+Sketches with the same relative error can be merged by adding up their
+bucket counts, and can be saved to (and loaded from) JSON, so the results
+of separate runs can be combined without re-reading the raw data.
+"""
+
+import math
+
+import numpy as np
+
+
+# values closer to zero than this are counted as zero
+MIN_VALUE = 1e-9
+
+
+class LatencySketch(object):
+    """A log-bucketed histogram with a bounded relative error."""
+
+    def __init__(self, relative_error=0.01):
+        """Create an empty sketch.
+
+        - relative_error: the max relative error of the percentiles read
+          back from the sketch (e.g. 0.01 for 1%)
+        """
+        if not 0 < relative_error < 1:
+            raise ValueError('relative_error must be between 0 and 1')
+        self.relative_error = relative_error
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self.log_gamma = math.log(self.gamma)
+        # maps bucket index to count, for positive and negative values
+        # (negative values are bucketed by their absolute value)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def _add_to_buckets(self, buckets, values):
+        """Count (positive) values into the given buckets."""
+        if not len(values):
+            return
+        indices = np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+        for (i, n) in zip(*np.unique(indices, return_counts=True)):
+            buckets[int(i)] = buckets.get(int(i), 0) + int(n)
+
+    def add_many(self, values):
+        """Add an array of values to the sketch."""
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        self._add_to_buckets(self.positive, values[values >= MIN_VALUE])
+        self._add_to_buckets(self.negative, -values[values <= -MIN_VALUE])
+        self.zero_count += int(np.sum(np.abs(values) < MIN_VALUE))
+        self.count += len(values)
+        low, high = float(np.min(values)), float(np.max(values))
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def add(self, value):
+        """Add a single value to the sketch."""
+        self.add_many([value])
+
+    def merge(self, other):
+        """Add the counts of another sketch (of the same error) to this one."""
+        if other.relative_error != self.relative_error:
+            raise ValueError('Cannot merge sketches with relative errors '
+                             '%s and %s' % (self.relative_error,
+                                            other.relative_error))
+        for (buckets, other_buckets) in ((self.positive, other.positive),
+                                         (self.negative, other.negative)):
+            for (i, n) in other_buckets.iteritems():
+                buckets[i] = buckets.get(i, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        for (attr, pick) in (('min', min), ('max', max)):
+            values = [v for v in (getattr(self, attr), getattr(other, attr))
+                      if v is not None]
+            setattr(self, attr, pick(values) if values else None)
+
+    def _value(self, index):
+        """Get the representative value of a (positive) bucket."""
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def percentile(self, p):
+        """Get the approximate p-th percentile (0 - 100) of the values."""
+        if not self.count:
+            raise ValueError('Cannot take a percentile of an empty sketch')
+        # the (0-based) rank of the value we want, as in np.percentile
+        rank = p / 100.0 * (self.count - 1)
+        seen = 0
+        # walk the buckets from the most negative value to the most positive
+        for i in sorted(self.negative, reverse=True):
+            seen += self.negative[i]
+            if seen > rank:
+                return max(-self._value(i), self.min)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for i in sorted(self.positive):
+            seen += self.positive[i]
+            if seen > rank:
+                return min(self._value(i), self.max)
+        return self.max
+
+    def to_dict(self):
+        """Convert the sketch to a dict that can be written out as JSON."""
+        return {
+            'relative_error': self.relative_error,
+            'positive': {str(i): n for (i, n) in self.positive.iteritems()},
+            'negative': {str(i): n for (i, n) in self.negative.iteritems()},
+            'zero_count': self.zero_count,
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """Create a sketch from a dict made by to_dict."""
+        sketch = cls(d['relative_error'])
+        sketch.positive = {int(i): n for (i, n) in d['positive'].iteritems()}
+        sketch.negative = {int(i): n for (i, n) in d['negative'].iteritems()}
+        sketch.zero_count = d['zero_count']
+        sketch.count = d['count']
+        sketch.min = d['min']
+        sketch.max = d['max']
+        return sketch
@@ -13,12 +13,17 @@
 # limitations under the License.
 
 from flask import Flask
+from flask import g
 from flask import request
 from flask import jsonify
 import logging
+import time
 
 import profile_memcache
+import workload
 import profile_datastore
+import profile_query
+import schema
 
 app = Flask(__name__)
 
@@ -40,16 +45,72 @@ API_ENDPOINTS = (PREAMBLE +
                   - /profile_memcache_unique?bytes=(int)&gets=(int)&
                   sleep=(true/false)
                   -- async multiget memcache operations on different keys<br/>
+                  - /profile_memcache?bytes=(int)&compress=(none/zlib)&
+                  level=(int)&threshold=(int)&compressible=(true/false)
+                  -- a single memcache get/set operation on a compressed
+                     value<br/>
+                  - /profile_memcache?bytes=(int)&chunked=true
+                  -- a memcache get/set of a value (of any size) split
+                     into 1 MB chunks<br/>
+                  - /profile_memcache?bytes=(int)&threads=(int)&
+                  coalesce=(ms)&batch=(int)&values=(int)
+                  -- concurrent memcache gets coalesced into get_multis,
+                     against the same gets made plainly<br/>
+                  - /profile_local_cache?bytes=(int)&values=(int)&gets=(int)&
+                  cache_bytes=(int)&ttl=(float)
+                  -- repeated memcache reads through an in-process LRU
+                     cache, against the same reads made directly<br/>
+                  - /profile_memcache?bytes=(int)&workload=(zipfian/uniform/
+                  recorded)&ops=(int)&keys=(int)&skew=(float)&reads=(float)&
+                  trace=(int,int,...)
+                  -- a mix of memcache gets/sets over a persistent
+                     keyspace<br/>
                   <br/>
                   - /profile_ndb?bytes=(int)
                   -- a single ndb put/get operation<br/>
                   - /profile_ndb?bytes=(int)&entities=(int)
                   -- an ndb multiput/multiget operation<br/>
+                  - /profile_ndb?bytes=(int)&entities=(int)&chunk=(int)
+                  -- an ndb multiput/multiget operation, in chunks sent
+                     at once<br/>
+                  - /profile_ndb?bytes=(int)&mode=async&entities=(int)&
+                  outstanding=(int)
+                  -- ndb put/get/deletes of many entities by tasklets
+                     (with up to outstanding at once), against the same
+                     made synchronously<br/>
+                  - /profile_ndb?bytes=(int)&entities=(int)&props=(int)&
+                  types=(string,int,blob,repeated)&indexed=(true,false)
+                  -- a batch ndb put/get of entities with that many
+                     properties (of those types, sharing the bytes)<br/>
+                  - /profile_ndb?bytes=(int)&workload=(...)&ops=(int)&...
+                  -- a mix of ndb gets/puts over a persistent keyspace (takes
+                     the same params as the memcache workload)<br/>
                   <br/>
                   - /profile_db?bytes=(int)
                   -- a single datastore put/get operation<br/>
                   - /profile_db?bytes=(int)&entities=(int)
-                  -- a batch datastore put/get operation<br/>""")
+                  -- a batch datastore put/get operation<br/>
+                  - /profile_db?bytes=(int)&entities=(int)&chunk=(int)
+                  -- a batch datastore put/get operation, in chunks sent
+                     at once<br/>
+                  - /profile_db?bytes=(int)&entities=(int)&props=(int)&
+                  types=(string,int,blob,repeated)&indexed=(true,false)
+                  -- a batch datastore put/get of entities with that many
+                     properties (of those types, sharing the bytes)<br/>
+                  <br/>
+                  - /profile_query?entities=(int)&bytes=(int)&api=(db/ndb)&
+                  mode=(eq/range/projection/keys_only/cursor)&limit=(int)&
+                  page=(int)
+                  -- a query against a dataset of that many entities
+                     (seeded by the first request for it)<br/>
+                  - /profile_contention?workers=(int)&keys=(int)&
+                  groups=(int)&txns=(int)&retries=(int)
+                  -- read-modify-write transactions on shared counters
+                     from that many workers at once<br/>
+                  <br/>
+                  Add &iterations=(int) to any of the above to run the
+                  operation that many times in one request and get back
+                  a list of times for each operation.<br/>""")
 
 
 @app.route('/')
@@ -58,6 +119,23 @@ def hello():
     return API_ENDPOINTS
 
 
+@app.before_request
+def start_timer():
+    g.request_start = time.time()
+
+
+@app.after_request
+def report_handler_time(response):
+    """Tell the client how long we spent handling the request.
+
+    This is measured from when Flask starts routing the request until the
+    response (including the JSON encoding) is ready, so the client can
+    subtract it from the round-trip time to get the network time.
+    """
+    response.headers['X-Handler-Time'] = str(time.time() - g.request_start)
+    return response
+
+
 @app.errorhandler(500)
 def server_error(e):
     logging.exception('An error occurred during a request.')
@@ -67,6 +145,70 @@ def server_error(e):
     """.format(e), 500
 
 
+@app.errorhandler(ValueError)
+def bad_request(e):
+    # the request's params are missing or out of range
+    logging.warning('Bad request: %s' % e)
+    return """
+    Bad request: <pre>{}</pre>
+    """.format(e), 400
+
+
+def profile(profile_fn, *args):
+    """Run a profiling function and return its results as JSON.
+
+    If the request has an iterations=(int) param, the function is run that
+    many times and each key of the result holds the list of per-iteration
+    values, so one request can take many samples.
+    """
+    iterations = request.args.get('iterations')
+    if not iterations:
+        return jsonify(profile_fn(*args))
+
+    iterations = int(iterations)
+    if iterations < 1:
+        raise ValueError("iterations must be at least 1")
+    results = [profile_fn(*args) for _ in xrange(iterations)]
+    batched = {key: [r[key] for r in results] for key in results[0]}
+    batched['iterations'] = len(results)
+    return jsonify(batched)
+
+
+def get_workload(prefix):
+    """Get the workload.Workload described by the request's params.
+
+    The params are workload=(zipfian/uniform/recorded), keys=(int) (the
+    size of the keyspace), skew=(float), reads=(float) (the fraction of
+    operations that are reads) and trace=(int,int,...) (for recorded).
+    """
+    trace = request.args.get('trace')
+    trace = [int(i) for i in trace.split(',')] if trace else None
+    return workload.Workload(
+        prefix, int(request.args.get('keys', 1000)),
+        distribution=request.args.get('workload'),
+        skew=float(request.args.get('skew', 0.99)),
+        read_fraction=float(request.args.get('reads', 0.9)),
+        trace=trace)
+
+
+def get_schema(num_bytes):
+    """Get the schema.Schema described by the request's params, if any.
+
+    The params are props=(int), types=(string,int,blob,repeated) and
+    indexed=(true,false) (both cycled through for the properties); num_bytes
+    is spread across the properties.
+    Return: the schema, or None if the request has no props param.
+    """
+    num_props = request.args.get('props')
+    if not num_props:
+        return None
+    return schema.Schema(int(num_props),
+                         request.args.get('types', 'string').split(','),
+                         [indexed == 'true' for indexed in
+                          request.args.get('indexed', 'true').split(',')],
+                         num_bytes)
+
+
 @app.route('/profile_memcache')
 def prof_memcache():
     num_bytes = int(request.args.get('bytes'))
@@ -74,19 +216,42 @@ def prof_memcache():
     num_values = request.args.get('values')
     num_gets = request.args.get('gets')
     sleep = (request.args.get('sleep') == 'true')
+    compress = request.args.get('compress')
+    chunked = (request.args.get('chunked') == 'true')
+    coalesce = request.args.get('coalesce')
+    workload_type = request.args.get('workload')
 
     num_threads = int(num_threads) if num_threads else None
     num_values = int(num_values) if num_values else None
     num_gets = int(num_gets) if num_gets else None
 
-    if not (num_threads or num_values or num_gets):
-        return jsonify(profile_memcache.single(num_bytes))
+    if workload_type:
+        num_ops = int(request.args.get('ops', 100))
+        return profile(profile_memcache.mixed, num_bytes, num_ops,
+                       get_workload('profile_memcache_workload'))
+    elif chunked:
+        return profile(profile_memcache.chunked, num_bytes)
+    elif coalesce:
+        # the window is given in milliseconds
+        window = float(coalesce) / 1000
+        max_batch = int(request.args.get('batch', 100))
+        return profile(profile_memcache.coalesced, num_bytes,
+                       num_threads or 10, num_values or num_threads or 10,
+                       window, max_batch)
+    elif compress:
+        level = int(request.args.get('level', 6))
+        threshold = int(request.args.get('threshold', 0))
+        compressible = (request.args.get('compressible') == 'true')
+        return profile(profile_memcache.compressed, num_bytes, compress,
+                       level, threshold, compressible)
+    elif not (num_threads or num_values or num_gets):
+        return profile(profile_memcache.single, num_bytes)
     elif num_threads:
-        return jsonify(profile_memcache.threaded(num_bytes, num_threads))
+        return profile(profile_memcache.threaded, num_bytes, num_threads)
     elif num_values:
-        return jsonify(profile_memcache.multi(num_bytes, num_values))
+        return profile(profile_memcache.multi, num_bytes, num_values)
     else:
-        return jsonify(profile_memcache.repeated(num_bytes, num_gets, sleep))
+        return profile(profile_memcache.repeated, num_bytes, num_gets, sleep)
 
 
 @app.route('/profile_memcache_unique')
@@ -95,36 +260,105 @@ def prof_memcache_unique():
     num_gets = int(request.args.get('gets'))
     sleep = (request.args.get('sleep') == 'true')
 
-    return jsonify(profile_memcache.repeated_unique(num_bytes,
-                                                    num_gets,
-                                                    sleep))
+    return profile(profile_memcache.repeated_unique, num_bytes, num_gets,
+                   sleep)
+
+
+@app.route('/profile_local_cache')
+def prof_local_cache():
+    num_bytes = int(request.args.get('bytes'))
+    num_values = int(request.args.get('values', 10))
+    num_gets = int(request.args.get('gets', 100))
+    max_bytes = int(request.args.get('cache_bytes', 1 << 20))
+    ttl = request.args.get('ttl')
+
+    ttl = float(ttl) if ttl else None
+
+    return profile(profile_memcache.local_cached, num_bytes, num_values,
+                   num_gets, max_bytes, ttl)
 
 
 @app.route('/profile_db')
 def prof_datastore():
     num_bytes = int(request.args.get('bytes'))
     num_entities = request.args.get('entities')
+    chunk_size = request.args.get('chunk')
 
     num_entities = int(num_entities) if num_entities else None
+    chunk_size = int(chunk_size) if chunk_size else None
+
+    entity_schema = get_schema(num_bytes)
 
-    if not num_entities:
-        return jsonify(profile_datastore.single_db(num_bytes))
+    if entity_schema:
+        return profile(profile_datastore.schema_db, entity_schema,
+                       num_entities or 1)
+    elif not num_entities:
+        return profile(profile_datastore.single_db, num_bytes)
+    elif chunk_size:
+        return profile(profile_datastore.chunked_db, num_bytes,
+                       num_entities, chunk_size)
     else:
-        return jsonify(profile_datastore.multi_db(num_bytes,
-                                                  num_entities))
+        return profile(profile_datastore.multi_db, num_bytes,
+                       num_entities)
 
 
 @app.route('/profile_ndb')
 def prof_ndb():
     num_bytes = int(request.args.get('bytes'))
     num_entities = request.args.get('entities')
+    chunk_size = request.args.get('chunk')
 
     num_entities = int(num_entities) if num_entities else None
+    chunk_size = int(chunk_size) if chunk_size else None
 
-    if not num_entities:
-        return jsonify(profile_datastore.single_ndb(num_bytes))
+    entity_schema = get_schema(num_bytes)
+
+    if entity_schema:
+        return profile(profile_datastore.schema_ndb, entity_schema,
+                       num_entities or 1)
+    elif request.args.get('mode') == 'async':
+        outstanding = int(request.args.get('outstanding', 10))
+        return profile(profile_datastore.pipelined_ndb, num_bytes,
+                       num_entities or 1, outstanding)
+    elif request.args.get('workload'):
+        num_ops = int(request.args.get('ops', 100))
+        return profile(profile_datastore.mixed_ndb, num_bytes, num_ops,
+                       get_workload('profile_ndb_workload'))
+    elif not num_entities:
+        return profile(profile_datastore.single_ndb, num_bytes)
+    elif chunk_size:
+        return profile(profile_datastore.chunked_ndb, num_bytes,
+                       num_entities, chunk_size)
+    else:
+        return profile(profile_datastore.multi_ndb, num_bytes, num_entities)
+
+
+@app.route('/profile_query')
+def prof_query():
+    num_entities = int(request.args.get('entities', 1000))
+    num_bytes = int(request.args.get('bytes', 100))
+    mode = request.args.get('mode', 'eq')
+    limit = int(request.args.get('limit', 100))
+    page_size = int(request.args.get('page', 20))
+
+    if request.args.get('api') == 'db':
+        return profile(profile_query.query_db, num_entities, num_bytes, mode,
+                       limit, page_size)
     else:
-        return jsonify(profile_datastore.multi_ndb(num_bytes, num_entities))
+        return profile(profile_query.query_ndb, num_entities, num_bytes,
+                       mode, limit, page_size)
+
+
+@app.route('/profile_contention')
+def prof_contention():
+    num_workers = int(request.args.get('workers', 10))
+    num_keys = int(request.args.get('keys', 1))
+    num_groups = int(request.args.get('groups', 0))
+    num_txns = int(request.args.get('txns', 10))
+    max_retries = int(request.args.get('retries', 10))
+
+    return profile(profile_datastore.contended_ndb, num_workers, num_keys,
+                   num_groups, num_txns, max_retries)
 
 if __name__ == '__main__':
     # This is used when running locally. Gunicorn is used to run the
@@ -24,3 +24,24 @@ class SampleModel(db.Model):
     def __eq__(self, other):
         # Check that name and email properties are equal
         return self.name == other.name and self.email == other.email
+
+
+class QueryNdbModel(ndb.Model):
+    # Model for profiling queries (see profile_query)
+    group = ndb.IntegerProperty()
+    rank = ndb.IntegerProperty()
+    name = ndb.StringProperty()
+    payload = ndb.TextProperty()
+
+
+class QueryModel(db.Model):
+    # Model for profiling queries (see profile_query)
+    group = db.IntegerProperty()
+    rank = db.IntegerProperty()
+    name = db.StringProperty()
+    payload = db.TextProperty()
+
+
+class CounterNdbModel(ndb.Model):
+    # Model for profiling transaction contention (see contended_ndb)
+    count = ndb.IntegerProperty(default=0)
@@ -0,0 +1,93 @@
+"""A process-wide pool of random payloads for the profiling functions.
+
+Generating a fresh os.urandom() value (and base64 encoding it) for every
+entity and every request costs real CPU time at 100 KB+, which shows up in
+the handler time. Instead we generate one random buffer per size class
+(powers of two) the first time it's needed, and hand out slices of it. The
+start of the slice moves along by a byte each time, so consecutive values
+of the same size are still distinct.
+
+Random bytes don't compress, so there's also a pool of text-like data made
+of words from a small vocabulary, for profiling compression.
+"""
+import base64
+import os
+import threading
+
+# the number of distinct values of each size before they start repeating
+ROTATIONS = 4096
+
+# the kinds of data we have pools of
+RANDOM = 'random'
+BASE64 = 'base64'
+COMPRESSIBLE = 'compressible'
+
+# the (random) words that compressible data is made of
+_WORDS = [base64.b32encode(os.urandom(1 + i % 6)).rstrip('=').lower() + ' '
+          for i in xrange(256)]
+
+
+def _compressible(num_bytes):
+    """Generate text-like data (that zlib shrinks about 3-4x)."""
+    data = []
+    length = 0
+    while length < num_bytes:
+        words = ''.join(_WORDS[ord(c)] for c in os.urandom(1 << 14))
+        data.append(words)
+        length += len(words)
+    return ''.join(data)[:num_bytes]
+
+
+class _SizeClass(object):
+    """A buffer that values up to a given size are sliced from."""
+
+    def __init__(self, size, kind):
+        """Generate the buffer.
+
+        - size: the max size of the values to slice from it
+        - kind: the kind of data (RANDOM, BASE64 or COMPRESSIBLE)
+        """
+        if kind == BASE64:
+            # base64 makes 4 characters out of every 3 bytes
+            data = base64.b64encode(os.urandom((size + ROTATIONS) * 3 // 4 +
+                                               3))
+        elif kind == COMPRESSIBLE:
+            data = _compressible(size + ROTATIONS)
+        else:
+            data = os.urandom(size + ROTATIONS)
+        self.data = data
+        self.offset = 0
+
+
+# the size classes, by (size, kind)
+_classes = {}
+_lock = threading.Lock()
+
+
+def _slice(num_bytes, kind):
+    """Get the next value of the given size from its size class."""
+    size = 1
+    while size < num_bytes:
+        size *= 2
+    with _lock:
+        size_class = _classes.get((size, kind))
+        if size_class is None:
+            size_class = _classes[(size, kind)] = _SizeClass(size, kind)
+        offset = size_class.offset
+        size_class.offset = (offset + 1) % ROTATIONS
+    return size_class.data[offset:offset + num_bytes]
+
+
+def get_bytes(num_bytes):
+    """Get num_bytes of random data, as a string."""
+    return _slice(num_bytes, RANDOM)
+
+
+def get_text(num_bytes):
+    """Get random base64 text, as long as b64encode(os.urandom(num_bytes))."""
+    return _slice(4 * ((num_bytes + 2) // 3), BASE64)
+
+
+def get_compressible(num_bytes):
+    """Get num_bytes of compressible (text-like) data, as a string."""
+    return _slice(num_bytes, COMPRESSIBLE)
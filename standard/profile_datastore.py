@@ -1,13 +1,15 @@
 """Some convenience methods for testing the database."""
 
-import base64
-import os
+import random
 import time
+import uuid
 
 from google.appengine.ext import db
 from google.appengine.ext import ndb
 
 import models
+import payloads
+import workers
 
 
 def single_db(num_bytes):
@@ -17,8 +19,8 @@ def single_db(num_bytes):
     Return: the time for put, get, and delete operations,
             and whether the data access succeeded.
     """
-    sample = models.SampleModel(name=base64.b64encode(os.urandom(num_bytes)),
-                                email=base64.b64encode(os.urandom(num_bytes)))
+    sample = models.SampleModel(name=payloads.get_text(num_bytes),
+                                email=payloads.get_text(num_bytes))
 
     # time put
     put_start = time.time()
@@ -57,8 +59,8 @@ def multi_db(num_bytes, num_entities):
     entities = []
     for i in range(num_entities):
         entities.append(models.SampleModel(
-                        name=base64.b64encode(os.urandom(num_bytes)),
-                        email=base64.b64encode(os.urandom(num_bytes))))
+                        name=payloads.get_text(num_bytes),
+                        email=payloads.get_text(num_bytes)))
 
     # time put
     put_start = time.time()
@@ -98,8 +100,8 @@ def single_ndb(num_bytes):
     ndb.get_context().set_cache_policy(False)
 
     sample = models.SampleNdbModel(
-        name=base64.b64encode(os.urandom(num_bytes)),
-        email=base64.b64encode(os.urandom(num_bytes)))
+        name=payloads.get_text(num_bytes),
+        email=payloads.get_text(num_bytes))
 
     # time put
     put_start = time.time()
@@ -140,8 +142,8 @@ def multi_ndb(num_bytes, num_entities):
     entities = []
     for i in range(num_entities):
         entities.append(models.SampleNdbModel(
-            name=base64.b64encode(os.urandom(num_bytes)),
-            email=base64.b64encode(os.urandom(num_bytes))))
+            name=payloads.get_text(num_bytes),
+            email=payloads.get_text(num_bytes)))
 
     # time put
     put_start = time.time()
@@ -164,3 +166,468 @@ def multi_ndb(num_bytes, num_entities):
         'del_time': delete_end - delete_start,
         'correct': result == entities
     }
+
+
+def mixed_ndb(num_bytes, num_ops, workload):
+    """Make a mix of ndb gets and puts of entities from a persistent keyspace.
+
+    The entities are left in datastore for later requests.
+    - num_bytes: number of bytes to assign to data properties
+    - num_ops: number of operations to make
+    - workload: the workload.Workload to draw the operations from
+    Return: the total and mean time for the gets and for the puts, the
+            number of operations per second, the fraction of gets that
+            found an entity, and the number of distinct keys used. The
+            means are None if there were no gets (or puts).
+    """
+    # disable memcache
+    ndb.get_context().set_memcache_policy(False)
+    ndb.get_context().set_cache_policy(False)
+
+    ops = workload.ops(num_ops)
+
+    results = []
+    start = time.time()
+    for (is_write, name) in ops:
+        key = ndb.Key(models.SampleNdbModel, name)
+        op_start = time.time()
+        if is_write:
+            models.SampleNdbModel(
+                key=key,
+                name=payloads.get_text(num_bytes),
+                email=payloads.get_text(num_bytes)).put()
+            found = True
+        else:
+            found = key.get(use_memcache=False) is not None
+        results.append((is_write, found, time.time() - op_start))
+    end = time.time()
+
+    get_times = [t for (is_write, _, t) in results if not is_write]
+    put_times = [t for (is_write, _, t) in results if is_write]
+    hits = sum(1 for (is_write, found, _) in results
+               if found and not is_write)
+    return {
+        'get_time': sum(get_times, 0.0),
+        'set_time': sum(put_times, 0.0),
+        'mean_get_time': (sum(get_times) / len(get_times) if get_times
+                          else None),
+        'mean_set_time': (sum(put_times) / len(put_times) if put_times
+                          else None),
+        'ops_per_sec': num_ops / (end - start),
+        'hit_ratio': float(hits) / len(get_times) if get_times else None,
+        'reads': len(get_times),
+        'writes': len(put_times),
+        'distinct_keys': len(set(key for (_, key) in ops)),
+        # (the puts and gets raise if they fail)
+        'correct': True,
+    }
+
+
+def _chunks(items, chunk_size):
+    """Split a list into chunks of (at most) chunk_size items."""
+    return [items[i:i + chunk_size] for i in xrange(0, len(items), chunk_size)]
+
+
+def _wait_chunks(start, waits):
+    """Wait for each chunk's async calls in turn.
+
+    - start: when the calls were started
+    - waits: a function for each chunk that waits for its calls
+    Return: the result of each wait, and the time from the start until
+            each chunk was done (or at least, until we saw it was).
+    """
+    results, times = [], []
+    for wait in waits:
+        results.append(wait())
+        times.append(time.time() - start)
+    return results, times
+
+
+def chunked_db(num_bytes, num_entities, chunk_size):
+    """Make a batch request to database db, in chunks sent at once.
+
+    Each chunk is its own async put/get/delete call, and all of the calls
+    are started before waiting for any of them.
+    - num_bytes: number of bytes to assign to data properties
+    - num_entities: number of entities to send in all
+    - chunk_size: max number of entities in each call
+    Return: the time for all of the put, get, and delete calls, the time
+            until each call was done, the number of chunks, the number of
+            entities put/got/deleted per second, and whether the data
+            access succeeded.
+    """
+    entities = []
+    for i in range(num_entities):
+        entities.append(models.SampleModel(
+                        name=payloads.get_text(num_bytes),
+                        email=payloads.get_text(num_bytes)))
+    chunks = _chunks(entities, chunk_size)
+
+    # time put
+    put_start = time.time()
+    rpcs = [db.put_async(chunk) for chunk in chunks]
+    _, put_times = _wait_chunks(put_start,
+                                [rpc.get_result for rpc in rpcs])
+    put_end = time.time()
+
+    # get the keys
+    key_chunks = [[e.key() for e in chunk] for chunk in chunks]
+
+    # time get
+    get_start = time.time()
+    rpcs = [db.get_async(chunk) for chunk in key_chunks]
+    results, get_times = _wait_chunks(get_start,
+                                      [rpc.get_result for rpc in rpcs])
+    get_end = time.time()
+    result = [entity for chunk in results for entity in chunk]
+
+    # time delete
+    delete_start = time.time()
+    rpcs = [db.delete_async(chunk) for chunk in key_chunks]
+    _, delete_times = _wait_chunks(delete_start,
+                                   [rpc.get_result for rpc in rpcs])
+    delete_end = time.time()
+
+    return {
+        'set_time': put_end - put_start,
+        'get_time': get_end - get_start,
+        'del_time': delete_end - delete_start,
+        'set_chunk_times': put_times,
+        'get_chunk_times': get_times,
+        'del_chunk_times': delete_times,
+        'chunks': len(chunks),
+        'entities_per_sec': 3 * num_entities / ((put_end - put_start) +
+                                                (get_end - get_start) +
+                                                (delete_end - delete_start)),
+        'correct': result == entities,
+    }
+
+
+def chunked_ndb(num_bytes, num_entities, chunk_size):
+    """Make a batch request to database ndb, in chunks sent at once.
+
+    Each chunk is its own async put_multi/get_multi/delete_multi call, and
+    all of the calls are started before waiting for any of them.
+    - num_bytes: number of bytes to assign to data properties
+    - num_entities: number of data entities (or rows) to set in all
+    - chunk_size: max number of entities in each call
+    Return: the time for all of the put, get, and delete calls, the time
+            until each call was done, the number of chunks, the number of
+            entities put/got/deleted per second, and whether the data
+            access succeeded.
+    """
+    # disable memcache
+    ndb.get_context().set_memcache_policy(False)
+    ndb.get_context().set_cache_policy(False)
+
+    # create an array of entities
+    entities = []
+    for i in range(num_entities):
+        entities.append(models.SampleNdbModel(
+            name=payloads.get_text(num_bytes),
+            email=payloads.get_text(num_bytes)))
+    chunks = _chunks(entities, chunk_size)
+
+    def waiter(futures):
+        return lambda: [future.get_result() for future in futures]
+
+    # time put
+    put_start = time.time()
+    futures = [ndb.put_multi_async(chunk) for chunk in chunks]
+    key_chunks, put_times = _wait_chunks(put_start,
+                                         [waiter(f) for f in futures])
+    put_end = time.time()
+
+    # time get
+    get_start = time.time()
+    futures = [ndb.get_multi_async(chunk, use_memcache=False)
+               for chunk in key_chunks]
+    results, get_times = _wait_chunks(get_start,
+                                      [waiter(f) for f in futures])
+    get_end = time.time()
+    result = [entity for chunk in results for entity in chunk]
+
+    # time delete
+    delete_start = time.time()
+    futures = [ndb.delete_multi_async(chunk) for chunk in key_chunks]
+    _, delete_times = _wait_chunks(delete_start,
+                                   [waiter(f) for f in futures])
+    delete_end = time.time()
+
+    return {
+        'set_time': put_end - put_start,
+        'get_time': get_end - get_start,
+        'del_time': delete_end - delete_start,
+        'set_chunk_times': put_times,
+        'get_chunk_times': get_times,
+        'del_chunk_times': delete_times,
+        'chunks': len(chunks),
+        'entities_per_sec': 3 * num_entities / ((put_end - put_start) +
+                                                (get_end - get_start) +
+                                                (delete_end - delete_start)),
+        'correct': result == entities,
+    }
+
+
+@ndb.tasklet
+def _put_get_delete_async(sample):
+    """Put, get and delete an entity, yielding to other tasklets between.
+
+    Return (through the future): the times for the put, get and delete,
+    and whether the get returned the entity we put.
+    """
+    put_start = time.time()
+    key = yield sample.put_async()
+    put_end = time.time()
+
+    result = yield key.get_async(use_memcache=False)
+    get_end = time.time()
+
+    yield key.delete_async()
+    delete_end = time.time()
+
+    raise ndb.Return((put_end - put_start, get_end - put_end,
+                      delete_end - get_end, result == sample))
+
+
+def pipelined_ndb(num_bytes, num_entities, outstanding):
+    """Make ndb put/get/deletes of many entities, overlapping them.
+
+    Each entity is put, got and deleted by its own tasklet, and up to
+    outstanding of them are kept going at once. The same is then done
+    synchronously, one operation at a time, to compare against.
+    - num_bytes: number of bytes to assign to data properties
+    - num_entities: number of entities to put/get/delete
+    - outstanding: max number of entities in flight at once
+    Return: the mean time for the put, get, and delete operations, and the
+            time for all of them, with tasklets and synchronously; how many
+            times faster the tasklets were; and whether the data access
+            succeeded.
+    """
+    if num_entities < 1:
+        raise ValueError("Need at least one entity")
+    if outstanding < 1:
+        raise ValueError("Need at least one entity outstanding")
+
+    # disable memcache
+    ndb.get_context().set_memcache_policy(False)
+    ndb.get_context().set_cache_policy(False)
+
+    entities = []
+    for i in range(num_entities):
+        entities.append(models.SampleNdbModel(
+            name=payloads.get_text(num_bytes),
+            email=payloads.get_text(num_bytes)))
+
+    # time the tasklets, starting another whenever one finishes
+    results = []
+    pending = []
+    start = time.time()
+    for sample in entities:
+        if len(pending) >= outstanding:
+            finished = ndb.Future.wait_any(pending)
+            pending.remove(finished)
+            results.append(finished.get_result())
+        pending.append(_put_get_delete_async(sample))
+    for future in pending:
+        results.append(future.get_result())
+    end = time.time()
+
+    # time the same operations synchronously
+    sync_results = []
+    sync_start = time.time()
+    for sample in entities:
+        put_start = time.time()
+        key = sample.put()
+        put_end = time.time()
+        result = key.get(use_memcache=False)
+        get_end = time.time()
+        key.delete()
+        delete_end = time.time()
+        sync_results.append((put_end - put_start, get_end - put_end,
+                             delete_end - get_end, result == sample))
+    sync_end = time.time()
+
+    def mean(times):
+        return sum(times) / len(times)
+
+    return {
+        'set_time': mean([r[0] for r in results]),
+        'get_time': mean([r[1] for r in results]),
+        'del_time': mean([r[2] for r in results]),
+        'total_time': end - start,
+        'sync_set_time': mean([r[0] for r in sync_results]),
+        'sync_get_time': mean([r[1] for r in sync_results]),
+        'sync_del_time': mean([r[2] for r in sync_results]),
+        'sync_total_time': sync_end - sync_start,
+        'overlap_gain': (sync_end - sync_start) / (end - start),
+        'correct': all(r[3] for r in results + sync_results),
+    }
+
+
+def schema_db(schema, num_entities):
+    """Make a batch request to database db, of entities of a generated schema.
+
+    - schema: the schema.Schema of the entities
+    - num_entities: number of entities to send in batch request
+    Return: the time for put, get, and delete operations, the number of
+            properties, and whether the data access succeeded.
+    """
+    model = schema.db_model()
+    entities = [model(**schema.values()) for _ in range(num_entities)]
+
+    # time put
+    put_start = time.time()
+    db.put(entities)
+    put_end = time.time()
+
+    # get the keys
+    keys = [e.key() for e in entities]
+
+    # time get
+    get_start = time.time()
+    result = db.get(keys)
+    get_end = time.time()
+
+    # time delete
+    delete_start = time.time()
+    db.delete(keys)
+    delete_end = time.time()
+
+    return {
+        'set_time': put_end - put_start,
+        'get_time': get_end - get_start,
+        'del_time': delete_end - delete_start,
+        'props': schema.num_props,
+        'correct': all(
+            [getattr(r, name) for name in schema.names] ==
+            [getattr(e, name) for name in schema.names]
+            for (r, e) in zip(result, entities)),
+    }
+
+
+def schema_ndb(schema, num_entities):
+    """Make a batch request to database ndb, of entities of a generated schema.
+
+    - schema: the schema.Schema of the entities
+    - num_entities: number of entities to send in batch request
+    Return: the time for put, get, and delete operations, the number of
+            properties, and whether the data access succeeded.
+    """
+    # disable memcache
+    ndb.get_context().set_memcache_policy(False)
+    ndb.get_context().set_cache_policy(False)
+
+    model = schema.ndb_model()
+    entities = [model(**schema.values()) for _ in range(num_entities)]
+
+    # time put
+    put_start = time.time()
+    keys = ndb.put_multi(entities)
+    put_end = time.time()
+
+    # time get
+    get_start = time.time()
+    result = ndb.get_multi(keys, use_memcache=False)
+    get_end = time.time()
+
+    # time delete
+    delete_start = time.time()
+    ndb.delete_multi(keys)
+    delete_end = time.time()
+
+    return {
+        'set_time': put_end - put_start,
+        'get_time': get_end - get_start,
+        'del_time': delete_end - delete_start,
+        'props': schema.num_props,
+        'correct': result == entities,
+    }
+
+
+def contended_ndb(num_workers, num_keys, num_groups, num_txns, max_retries):
+    """Contend for shared counters with transactions from many workers.
+
+    Each worker makes num_txns transactions, each of which adds one to a
+    random counter, retrying (up to max_retries times) if it conflicts
+    with another transaction. The counters are in a namespace of their own,
+    so concurrent requests don't add to each other's counters, and are
+    deleted when we're done.
+    - num_workers: number of workers making transactions at once
+    - num_keys: number of counters they share
+    - num_groups: number of entity groups the counters are spread over
+      (0 to make each counter its own entity group)
+    - num_txns: number of transactions each worker makes
+    - max_retries: max number of times to retry a transaction
+    Return: the mean time for a transaction to commit (including its
+            retries) and the time for each, the total and max number of
+            retries, the number of transactions that gave up, the number
+            committed per second, and whether the counters add up.
+    """
+    if num_workers < 1 or num_keys < 1 or num_txns < 1:
+        raise ValueError("Need at least one worker, counter and transaction")
+    if num_groups < 0 or max_retries < 0:
+        raise ValueError("Groups and retries can't be negative")
+    namespace = 'profile_contention_%s' % uuid.uuid4().hex
+
+    def key(i):
+        if num_groups:
+            return ndb.Key('ContentionGroup', 'group%d' % (i % num_groups),
+                           models.CounterNdbModel, 'counter%d' % i,
+                           namespace=namespace)
+        return ndb.Key(models.CounterNdbModel, 'counter%d' % i,
+                       namespace=namespace)
+    keys = [key(i) for i in xrange(num_keys)]
+
+    def add_one(counter_key):
+        counter = counter_key.get() or models.CounterNdbModel(key=counter_key)
+        counter.count += 1
+        counter.put()
+
+    def increment():
+        """Add one to a random counter, retrying on conflicts.
+
+        Return: the time it took, the number of retries, and whether it
+                committed.
+        """
+        counter_key = random.choice(keys)
+        txn_start = time.time()
+        for retry in xrange(max_retries + 1):
+            try:
+                # we retry ourselves, so we can count the retries
+                ndb.transaction(lambda: add_one(counter_key), retries=0)
+                return time.time() - txn_start, retry, True
+            except db.TransactionFailedError:
+                pass
+        return time.time() - txn_start, max_retries, False
+
+    def worker():
+        # each thread has its own ndb context, so disable memcache in it
+        ndb.get_context().set_memcache_policy(False)
+        ndb.get_context().set_cache_policy(False)
+        return [increment() for _ in xrange(num_txns)]
+
+    # start the threads to make the transactions in (they're stopped when
+    # we're done with them, since they can't outlive the request)
+    with workers.WorkerPool(num_workers) as pool:
+        start = time.time()
+        results = pool.map(worker, [()] * num_workers)
+        end = time.time()
+    counts = [c.count if c else 0
+              for c in ndb.get_multi(keys, use_cache=False,
+                                     use_memcache=False)]
+    ndb.delete_multi(keys, use_cache=False, use_memcache=False)
+
+    txn_times = [t for r in results for (t, _, _) in r]
+    retries = [n for r in results for (_, n, _) in r]
+    committed = sum(1 for r in results for (_, _, ok) in r if ok)
+    return {
+        'commit_time': sum(txn_times) / len(txn_times),
+        'commit_times': txn_times,
+        'retries': sum(retries),
+        'max_retries': max(retries),
+        'failures': len(txn_times) - committed,
+        'txns_per_sec': committed / (end - start),
+        # every committed transaction added one to a counter
+        'correct': sum(counts) == committed,
+    }
@@ -0,0 +1,244 @@
+"""Some functions for profiling datastore queries.
+
+Each dataset (of a given number of entities, with a given number of bytes
+of unindexed payload each) lives in its own namespace, and is only seeded
+the first time it's queried, so later requests query a warm dataset. Entity
+i has rank i and is in group i % NUM_GROUPS.
+"""
+import random
+import time
+
+from google.appengine.ext import db
+from google.appengine.ext import ndb
+
+import models
+import payloads
+
+# the number of distinct values of the group property
+NUM_GROUPS = 10
+
+# the number of entities to put in each call when seeding a dataset
+SEED_BATCH_SIZE = 500
+
+# the kinds of query we can profile
+MODES = ('eq', 'range', 'projection', 'keys_only', 'cursor')
+
+
+def _namespace(num_entities, num_bytes):
+    """Get the namespace of a dataset."""
+    return 'profile_query_%d_%d' % (num_entities, num_bytes)
+
+
+def _check(mode, num_entities, limit, group, start, ranks):
+    """Check that a query returned the entities it should have.
+
+    - group: the group an eq or keys_only query filtered on
+    - start: the first rank a range query filtered on
+    - ranks: the ranks of the entities returned (or their names, for a
+      projection query)
+    """
+    if mode == 'range':
+        return ranks == range(start, min(start + limit, num_entities))
+    elif mode == 'cursor':
+        return ranks == range(min(limit, num_entities))
+    elif mode == 'projection':
+        return len(ranks) == min(limit, num_entities)
+    else:
+        # the entities come back in key order, not rank order
+        in_group = len(xrange(group, num_entities, NUM_GROUPS))
+        return (len(ranks) == min(limit, in_group) and
+                all(rank % NUM_GROUPS == group for rank in ranks))
+
+
+def _seed_ndb(num_entities, num_bytes):
+    """Put a dataset's entities with ndb, if they're not there already.
+
+    Return: the time it took to seed them, or None if they were there.
+    """
+    namespace = _namespace(num_entities, num_bytes)
+
+    def key(i):
+        return ndb.Key(models.QueryNdbModel, 'row%d' % i, namespace=namespace)
+
+    # the entities are put in order, so the last one is there only if
+    # they all are
+    if key(num_entities - 1).get(use_cache=False, use_memcache=False):
+        return None
+
+    start = time.time()
+    for batch_start in xrange(0, num_entities, SEED_BATCH_SIZE):
+        ndb.put_multi([
+            models.QueryNdbModel(key=key(i), group=i % NUM_GROUPS, rank=i,
+                                 name='name%d' % i,
+                                 payload=payloads.get_text(num_bytes))
+            for i in xrange(batch_start,
+                            min(batch_start + SEED_BATCH_SIZE, num_entities))
+        ], use_cache=False, use_memcache=False)
+    return time.time() - start
+
+
+def query_ndb(num_entities, num_bytes, mode, limit, page_size):
+    """Make a query with ndb against a persistent dataset.
+
+    - num_entities: number of entities in the dataset
+    - num_bytes: number of bytes of (unindexed) payload in each entity
+    - mode: the kind of query to make:
+      eq: entities of a random group (an equality filter)
+      range: entities with a rank in a random range (a range filter)
+      projection: the name of any entities (a projection query)
+      keys_only: keys of entities of a random group (an equality filter)
+      cursor: entities in rank order, a page at a time
+    - limit: the max number of results to get
+    - page_size: the number of results in each page, for cursor
+    Return: the time for the query (and for each page, for cursor), the
+            number of results, the time to seed the dataset (if this
+            request did), and whether the right results were returned.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown query mode: %s" % mode)
+
+    # disable memcache
+    ndb.get_context().set_memcache_policy(False)
+    ndb.get_context().set_cache_policy(False)
+
+    seed_time = _seed_ndb(num_entities, num_bytes)
+    namespace = _namespace(num_entities, num_bytes)
+    model = models.QueryNdbModel
+    group = random.randrange(NUM_GROUPS)
+    start = random.randrange(num_entities)
+    page_times = []
+
+    # time query
+    query_start = time.time()
+    if mode == 'eq':
+        results = model.query(model.group == group,
+                              namespace=namespace).fetch(limit)
+    elif mode == 'range':
+        results = model.query(model.rank >= start,
+                              model.rank < start + limit,
+                              namespace=namespace).fetch(limit)
+    elif mode == 'projection':
+        results = model.query(namespace=namespace).fetch(
+            limit, projection=[model.name])
+    elif mode == 'keys_only':
+        results = model.query(model.group == group,
+                              namespace=namespace).fetch(limit,
+                                                         keys_only=True)
+    else:
+        query = model.query(namespace=namespace).order(model.rank)
+        results = []
+        cursor = None
+        more = True
+        while more and len(results) < limit:
+            page_start = time.time()
+            page, cursor, more = query.fetch_page(
+                min(page_size, limit - len(results)), start_cursor=cursor)
+            page_times.append(time.time() - page_start)
+            results.extend(page)
+    query_end = time.time()
+
+    if mode == 'projection':
+        ranks = [r.name for r in results]
+    elif mode == 'keys_only':
+        ranks = [int(key.id()[len('row'):]) for key in results]
+    else:
+        ranks = [r.rank for r in results]
+
+    return {
+        'get_time': query_end - query_start,
+        'page_times': page_times,
+        'results': len(results),
+        'seed_time': seed_time,
+        'correct': _check(mode, num_entities, limit, group, start, ranks),
+    }
+
+
+def _seed_db(num_entities, num_bytes):
+    """Put a dataset's entities with db, if they're not there already.
+
+    Return: the time it took to seed them, or None if they were there.
+    """
+    namespace = _namespace(num_entities, num_bytes)
+
+    def key(i):
+        return db.Key.from_path('QueryModel', 'row%d' % i,
+                                namespace=namespace)
+
+    # the entities are put in order, so the last one is there only if
+    # they all are
+    if db.get(key(num_entities - 1)):
+        return None
+
+    start = time.time()
+    for batch_start in xrange(0, num_entities, SEED_BATCH_SIZE):
+        db.put([
+            models.QueryModel(key=key(i), group=i % NUM_GROUPS, rank=i,
+                              name='name%d' % i,
+                              payload=payloads.get_text(num_bytes))
+            for i in xrange(batch_start,
+                            min(batch_start + SEED_BATCH_SIZE, num_entities))
+        ])
+    return time.time() - start
+
+
+def query_db(num_entities, num_bytes, mode, limit, page_size):
+    """Make a query with db against a persistent dataset.
+
+    The params and results are the same as query_ndb.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown query mode: %s" % mode)
+
+    seed_time = _seed_db(num_entities, num_bytes)
+    namespace = _namespace(num_entities, num_bytes)
+    group = random.randrange(NUM_GROUPS)
+    start = random.randrange(num_entities)
+    page_times = []
+
+    # time query
+    query_start = time.time()
+    if mode == 'eq':
+        query = db.Query(models.QueryModel, namespace=namespace)
+        results = query.filter('group =', group).fetch(limit)
+    elif mode == 'range':
+        query = db.Query(models.QueryModel, namespace=namespace)
+        query.filter('rank >=', start).filter('rank <', start + limit)
+        results = query.fetch(limit)
+    elif mode == 'projection':
+        query = db.Query(models.QueryModel, projection=('name',),
+                         namespace=namespace)
+        results = query.fetch(limit)
+    elif mode == 'keys_only':
+        query = db.Query(models.QueryModel, keys_only=True,
+                         namespace=namespace)
+        results = query.filter('group =', group).fetch(limit)
+    else:
+        query = db.Query(models.QueryModel, namespace=namespace)
+        query.order('rank')
+        results = []
+        cursor = None
+        while len(results) < limit:
+            page_start = time.time()
+            page = query.with_cursor(cursor).fetch(
+                min(page_size, limit - len(results)))
+            page_times.append(time.time() - page_start)
+            if not page:
+                break
+            results.extend(page)
+            cursor = query.cursor()
+    query_end = time.time()
+
+    if mode == 'projection':
+        ranks = [r.name for r in results]
+    elif mode == 'keys_only':
+        ranks = [int(key.name()[len('row'):]) for key in results]
+    else:
+        ranks = [r.rank for r in results]
+
+    return {
+        'get_time': query_end - query_start,
+        'page_times': page_times,
+        'results': len(results),
+        'seed_time': seed_time,
+        'correct': _check(mode, num_entities, limit, group, start, ranks),
+    }
@@ -0,0 +1,168 @@
+"""Generate entities of a configurable schema, for profiling entity width.
+
+The sample models have two indexed string properties. A Schema instead has
+any number of properties, of the given types and each indexed or not
+(both cycled through in order), with the given total number of bytes spread
+across them, so we can see how each of those affects the cost of writes.
+"""
+import random
+import threading
+
+from google.appengine.ext import db
+from google.appengine.ext import ndb
+
+import payloads
+
+# the types of property a schema can have
+STRING = 'string'
+INT = 'int'
+BLOB = 'blob'
+REPEATED = 'repeated'
+TYPES = (STRING, INT, BLOB, REPEATED)
+
+# the number of values in each repeated property
+REPEATED_VALUES = 10
+
+# the longest value an indexed property can have
+MAX_INDEXED_BYTES = 1500
+
+# the max number of properties, and the max length of the patterns of
+# types and indexing they're given, which bound the number of distinct
+# schemas (and so of model classes, which are kept for good)
+MAX_PROPS = 100
+MAX_PATTERN = 4
+
+
+class Schema(object):
+    """The shape of the entities to profile."""
+
+    def __init__(self, num_props, types, indexed, num_bytes):
+        """Describe the schema.
+
+        - num_props: number of properties
+        - types: the types of the properties (from TYPES), which are
+          cycled through if there are fewer of them than properties
+        - indexed: whether each property is indexed, which is cycled
+          through like types
+        - num_bytes: the total number of bytes of the string, blob and
+          repeated properties (int properties are always 8 bytes)
+        """
+        if not 1 <= num_props <= MAX_PROPS:
+            raise ValueError("The number of properties must be from 1 to %s"
+                             % MAX_PROPS)
+        for prop_type in types:
+            if prop_type not in TYPES:
+                raise ValueError("Unknown property type: %s" % prop_type)
+        if not 1 <= len(types) <= MAX_PATTERN:
+            raise ValueError("Need from 1 to %s property types" % MAX_PATTERN)
+        if not 1 <= len(indexed) <= MAX_PATTERN:
+            raise ValueError("Need from 1 to %s values of indexed" %
+                             MAX_PATTERN)
+        self.num_props = num_props
+        self.type_pattern = list(types)
+        self.types = [types[i % len(types)] for i in xrange(num_props)]
+        self.index_pattern = list(indexed)
+        self.indexed = [indexed[i % len(indexed)] for i in xrange(num_props)]
+        self.num_bytes = num_bytes
+
+        sized = sum(1 for prop_type in self.types if prop_type != INT)
+        self.prop_bytes = num_bytes // sized if sized else 0
+        for (prop_type, prop_indexed) in zip(self.types, self.indexed):
+            # each value of a repeated property is indexed on its own
+            if (prop_indexed and
+                    self.value_bytes(prop_type) > MAX_INDEXED_BYTES):
+                raise ValueError("Indexed values can't be longer than %s "
+                                 "bytes" % MAX_INDEXED_BYTES)
+
+    @property
+    def names(self):
+        """Get the names of the properties."""
+        return ['prop%d' % i for i in xrange(self.num_props)]
+
+    @property
+    def kind(self):
+        """Get a kind name that's unique to the schema's properties."""
+        return 'Schema_%d_%s_%s' % (
+            self.num_props, '_'.join(self.type_pattern),
+            '_'.join('indexed' if prop_indexed else 'unindexed'
+                     for prop_indexed in self.index_pattern))
+
+    def value_bytes(self, prop_type):
+        """Get the number of bytes in each value of the given type."""
+        if prop_type == INT:
+            return 8
+        elif prop_type == REPEATED:
+            return self.prop_bytes // REPEATED_VALUES
+        return self.prop_bytes
+
+    def value(self, prop_type):
+        """Generate a value for a property of the given type."""
+        if prop_type == INT:
+            return random.getrandbits(62)
+        elif prop_type == BLOB:
+            return payloads.get_bytes(self.prop_bytes)
+        elif prop_type == REPEATED:
+            size = self.value_bytes(prop_type)
+            return [payloads.get_text(size)[:size]
+                    for _ in xrange(REPEATED_VALUES)]
+        else:
+            return payloads.get_text(self.prop_bytes)[:self.prop_bytes]
+
+    def values(self):
+        """Generate a value for each property, by name."""
+        return {name: self.value(prop_type)
+                for (name, prop_type) in zip(self.names, self.types)}
+
+    def _ndb_property(self, prop_type, indexed):
+        """Make an ndb property of the given type."""
+        if prop_type == INT:
+            return ndb.IntegerProperty(indexed=indexed)
+        elif prop_type == BLOB:
+            return ndb.BlobProperty(indexed=indexed)
+        elif prop_type == REPEATED:
+            return ndb.StringProperty(indexed=indexed, repeated=True)
+        else:
+            return ndb.StringProperty(indexed=indexed)
+
+    def _db_property(self, prop_type, indexed):
+        """Make a db property of the given type."""
+        if prop_type == INT:
+            return db.IntegerProperty(indexed=indexed)
+        elif prop_type == BLOB:
+            if indexed:
+                return db.ByteStringProperty()
+            return db.BlobProperty()
+        elif prop_type == REPEATED:
+            return db.StringListProperty(indexed=indexed)
+        elif indexed:
+            return db.StringProperty()
+        else:
+            return db.TextProperty()
+
+    def ndb_model(self):
+        """Get the ndb model class of the schema."""
+        return _model(self, ndb.Model, self._ndb_property)
+
+    def db_model(self):
+        """Get the db model class of the schema."""
+        return _model(self, db.Model, self._db_property)
+
+
+# the model classes made so far, by (base class, kind), since a kind can
+# only have one class (ndb and db keep every model class by kind anyway,
+# so this is bounded by the limits on schemas rather than evicted from)
+_models = {}
+_models_lock = threading.Lock()
+
+
+def _model(schema, base, make_property):
+    """Get the model class of a schema, making it the first time."""
+    with _models_lock:
+        model_key = (base, schema.kind)
+        if model_key not in _models:
+            props = {name: make_property(prop_type, indexed)
+                     for (name, prop_type, indexed) in zip(
+                         schema.names, schema.types, schema.indexed)}
+            # ndb and db both take the kind from the class name
+            _models[model_key] = type(schema.kind, (base,), props)
+        return _models[model_key]
@@ -0,0 +1,112 @@
+"""A pool of worker threads, for making calls in parallel.
+
+Threads on Standard can't outlive the request that started them, so each
+request starts its own pool (as a context manager), which stops its
+threads when the request is done with it.
+"""
+import Queue
+import logging
+import os
+import sys
+import threading
+import traceback
+
+# the most threads a pool can have
+MAX_THREADS = int(os.environ.get('WORKER_POOL_SIZE', '64'))
+
+if sys.version_info[0] < 3:
+    # (this is a syntax error on python 3, which can't even compile it)
+    exec('def _reraise(exc_info):\n'
+         '    raise exc_info[0], exc_info[1], exc_info[2]\n')
+else:
+    def _reraise(exc_info):
+        raise exc_info[1].with_traceback(exc_info[2])
+
+
+def check_num_threads(num_threads):
+    """Check that a number of threads is one a pool can have."""
+    if not 1 <= num_threads <= MAX_THREADS:
+        raise ValueError("The number of threads must be from 1 to %s" %
+                         MAX_THREADS)
+
+
+class WorkerPool(object):
+    """A fixed set of threads that run functions from a shared queue.
+
+    Use it as a context manager (or call close()) to stop the threads
+    once you're done with it.
+    """
+
+    def __init__(self, num_threads):
+        """Start the worker threads.
+
+        - num_threads: number of threads in the pool
+        """
+        check_num_threads(num_threads)
+        self.num_threads = num_threads
+        self._tasks = Queue.Queue()
+        self._threads = [threading.Thread(target=self._work)
+                         for _ in xrange(num_threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        """Run tasks from the queue until we get None."""
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            fn, args, results, i = task
+            try:
+                results.put((i, fn(*args), None))
+            except Exception:
+                results.put((i, None, sys.exc_info()))
+
+    def map(self, fn, args_list, max_concurrency=None):
+        """Call fn(*args) for each args in args_list, and wait for them all.
+
+        - max_concurrency: the max number of calls to have running at
+          once (defaults to as many as there are threads)
+        Return: the results, in the same order as args_list.
+        """
+        results = Queue.Queue()
+        pending = list(enumerate(args_list))
+        pending.reverse()
+
+        def submit():
+            i, args = pending.pop()
+            self._tasks.put((fn, args, results, i))
+
+        # start up to max_concurrency calls, and then another each time
+        # one finishes
+        for _ in xrange(min(max_concurrency or len(pending), len(pending))):
+            submit()
+        ordered = [None] * len(args_list)
+        error = None
+        for _ in xrange(len(args_list)):
+            i, result, exc_info = results.get()
+            if pending:
+                submit()
+            ordered[i] = result
+            error = error or exc_info
+        if error:
+            # re-raise the first error in this thread, with the traceback
+            # from the worker thread
+            logging.error('Error in worker thread:\n%s' %
+                          ''.join(traceback.format_exception(*error)))
+            _reraise(error)
+        return ordered
+
+    def close(self):
+        """Stop the worker threads once they're done with their tasks."""
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
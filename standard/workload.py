@@ -0,0 +1,108 @@
+"""A generator of reads and writes over a persistent keyspace.
+
+The single-shot profiling functions use fresh random keys and delete them
+straight away, so hot keys, eviction and warm caches never come into it. A
+Workload instead draws its keys from a fixed keyspace (the same key names
+in every request, which are never deleted) with a skewed or recorded
+distribution, and mixes reads and writes like real traffic does.
+"""
+import array
+import bisect
+import collections
+import random
+import threading
+
+# the distributions keys can be drawn from
+ZIPFIAN = 'zipfian'
+UNIFORM = 'uniform'
+RECORDED = 'recorded'
+DISTRIBUTIONS = (ZIPFIAN, UNIFORM, RECORDED)
+
+# the max number of keys in a keyspace (the Zipfian weights take 8 bytes
+# a key)
+MAX_KEYS = 1000 * 1000
+
+# the number of Zipfian distributions to keep the weights of
+ZIPF_CACHE_SIZE = 4
+
+# the cumulative weights of the Zipfian distributions, by (keys, skew),
+# least recently used first
+_zipf_cdfs = collections.OrderedDict()
+_zipf_lock = threading.Lock()
+
+
+def _zipf_cdf(num_keys, skew):
+    """Get the cumulative weights of a Zipfian distribution over the keys.
+
+    The key of rank i (from 0) has weight 1 / (i + 1) ** skew. These are
+    kept for the few most recently used distributions, since the keyspace
+    can be big.
+    """
+    with _zipf_lock:
+        cdf = _zipf_cdfs.pop((num_keys, skew), None)
+        if cdf is None:
+            cdf = array.array('d')
+            total = 0.0
+            for i in xrange(num_keys):
+                total += 1.0 / (i + 1) ** skew
+                cdf.append(total)
+            while len(_zipf_cdfs) >= ZIPF_CACHE_SIZE:
+                _zipf_cdfs.popitem(last=False)
+        _zipf_cdfs[(num_keys, skew)] = cdf
+        return cdf
+
+
+class Workload(object):
+    """A mix of reads and writes of keys from a fixed keyspace."""
+
+    def __init__(self, prefix, num_keys, distribution=ZIPFIAN, skew=0.99,
+                 read_fraction=0.9, trace=None):
+        """Create the workload.
+
+        - prefix: the prefix of the key names (key i is prefix_i)
+        - num_keys: the number of keys in the keyspace
+        - distribution: how keys are drawn (ZIPFIAN, UNIFORM or RECORDED)
+        - skew: the exponent of the Zipfian distribution (0 is uniform,
+          and the bigger it is the hotter the hottest keys are)
+        - read_fraction: the fraction of operations that are reads
+        - trace: for RECORDED, the key numbers to replay in order (over
+          and over, if there are more operations than that)
+        """
+        if not 1 <= num_keys <= MAX_KEYS:
+            raise ValueError("The number of keys must be from 1 to %d" %
+                             MAX_KEYS)
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError("Unknown distribution: %s" % distribution)
+        if distribution == RECORDED and not trace:
+            raise ValueError("A recorded distribution needs a trace")
+        self.prefix = prefix
+        self.num_keys = num_keys
+        self.distribution = distribution
+        self.skew = skew
+        self.read_fraction = read_fraction
+        self.trace = trace
+        self._position = 0
+
+    def key(self, i):
+        """Get the name of key number i."""
+        return '%s_%d' % (self.prefix, i % self.num_keys)
+
+    def _draw(self):
+        """Draw the number of the next key to use."""
+        if self.distribution == ZIPFIAN:
+            cdf = _zipf_cdf(self.num_keys, self.skew)
+            return bisect.bisect(cdf, random.random() * cdf[-1])
+        elif self.distribution == UNIFORM:
+            return random.randrange(self.num_keys)
+        else:
+            i = self.trace[self._position % len(self.trace)]
+            self._position += 1
+            return i
+
+    def ops(self, num_ops):
+        """Generate the next num_ops operations.
+
+        Return: a (whether it's a write, key name) pair for each operation.
+        """
+        return [(random.random() >= self.read_fraction, self.key(self._draw()))
+                for _ in xrange(num_ops)]
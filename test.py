@@ -14,33 +14,265 @@ by parse_data.py to extract percentiles for the latencies.
 import argparse
 import csv
 import datetime
+import functools
 import logging
+import multiprocessing.pool
+import os
+import random
 import sys
+import threading
+import time
 
 import requests
+import requests.adapters
 try:
     import tqdm
     progress_bar = tqdm.tqdm
 except ImportError:  # No module named "tqdm"
     logging.info("To get nice progress bars, `pip install tqdm`.")
 
-    def progress_bar(x):
+    def progress_bar(x, **kwargs):
         """Placeholder progress bar."""
         return x
 
 # the data columns we expect from the server
 HEADER_ROW = ['timestamp', 'type', 'request_url', 'params', 'correct',
-              'del_time (ms)', 'get_time (ms)', 'set_time (ms)']
+              'del_time (ms)', 'get_time (ms)', 'set_time (ms)',
+              'intended_start (ms)', 'actual_start (ms)', 'queue_time (ms)',
+              'rtt (ms)', 'handler_time (ms)', 'network_time (ms)',
+              'framework_time (ms)', 'retried', 'new_connection']
 
 
-def test_request(request, params_list, num_samples, test_std):
-    """Run a test on the [/profile_memcache&bytes=] endpoint."""
+def monotonic_clock():
+    """Get a clock (in s) that never jumps, for timing requests.
+
+    The wall clock (time.time) can be slewed or stepped by NTP in the
+    middle of a run, which would go straight into the round-trip times.
+    Python 2 doesn't have time.monotonic, so use the monotonic backport if
+    it's installed, and otherwise clock_gettime(CLOCK_MONOTONIC) directly.
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    try:
+        import monotonic
+        return monotonic.monotonic
+    except ImportError:
+        pass
+
+    import ctypes
+    import ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    # CLOCK_MONOTONIC is 6 on macOS and 1 on Linux
+    clock_id = 6 if sys.platform == 'darwin' else 1
+    library = ctypes.util.find_library('rt') or ctypes.util.find_library('c')
+    try:
+        clock_gettime = ctypes.CDLL(library, use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+        raise RuntimeError("No monotonic clock available: "
+                           "`pip install monotonic`.")
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+    def clock():
+        t = timespec()
+        if clock_gettime(clock_id, ctypes.pointer(t)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return t.tv_sec + t.tv_nsec * 1e-9
+    return clock
+
+
+# the clock to time requests with
+clock = monotonic_clock()
+
+
+def arrival_times(rate, num_samples, poisson):
+    """Generate the times (in s, from the start) at which to send requests.
+
+    - rate: the number of requests to send per second
+    - poisson: whether to use Poisson arrivals instead of a fixed schedule
+    """
+    offset = 0.0
+    for i in xrange(num_samples):
+        if poisson:
+            offset += random.expovariate(rate)
+        else:
+            offset = i / float(rate)
+        yield offset
+
+
+# whether the request each worker thread is making has opened a new
+# connection (and so paid for the TCP/TLS handshake); see take_sample
+_connections = threading.local()
+
+
+def _noting_connects(pool_class):
+    """Subclass a urllib3 connection pool to note when it connects.
+
+    Each request is made in its worker's thread, so a connection made
+    while it's in flight is that request's (in _connections.opened).
+    """
+    class Connection(pool_class.ConnectionCls):
+        def connect(self):
+            _connections.opened = True
+            return super(Connection, self).connect()
+
+    class Pool(pool_class):
+        ConnectionCls = Connection
+    return Pool
+
+
+def make_session(pool_size, retries):
+    """Create an HTTP session that keeps connections alive and reuses them.
+
+    The session is shared by all the workers.
+    - pool_size: the number of connections to keep open to the app
+    - retries: the number of times to retry a request that failed to
+      connect or got a 502/503/504 from the frontend
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_maxsize=pool_size,
+        max_retries=requests.adapters.Retry(
+            total=retries, backoff_factor=0.1,
+            # Without retries, a 502/503/504 is recorded like any other
+            # response rather than raising; with them, the last response
+            # is recorded if they all fail.
+            status_forcelist=(502, 503, 504) if retries else (),
+            raise_on_status=False))
+    manager = adapter.poolmanager
+    manager.pool_classes_by_scheme = {
+        scheme: _noting_connects(pool_class)
+        for (scheme, pool_class) in manager.pool_classes_by_scheme.items()}
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def op_time(result, key):
+    """Get the time (in s) of one kind of operation from a result.
+
+    Endpoints that don't make that kind of operation leave it out, or send
+    null for it (e.g. a workload with no writes), which count as 0.
+    """
+    return result.get(key) or 0
+
+
+def take_sample(session, test_url, request, params, test_type, run_start,
+                iterations=1, intended_start=None):
+    """Make a single request and return the resulting rows of the CSV file.
+
+    - session: the session to make the request with (see make_session)
+    - run_start: the clock() time at which the param set started
+    - iterations: the number of times the app should run the operations
+      in this request; each iteration becomes its own row
+    - intended_start: the clock() time at which the request should have
+      been sent (None if it is sent as soon as a worker is free)
+    Return: the rows to write out (none if the request failed).
+    """
+    # the difference between when we meant to send the request and when
+    # we actually sent it is the time it spent queued behind earlier ones
+    actual_start = clock()
+    if intended_start is None:
+        intended_start = actual_start
+    request_params = (dict(params, iterations=iterations) if iterations > 1
+                      else params)
+    try:
+        _connections.opened = False
+        response = session.get(test_url + request, params=request_params)
+        rtt = clock() - actual_start
+        # the rtt includes any retries (and the waits between them), so
+        # retried samples are marked, as are those that had to connect
+        retries = getattr(response.raw, 'retries', None)
+        retried = bool(retries and retries.history)
+        new_connection = _connections.opened
+        result = response.json()
+        handler_time = response.headers.get('X-Handler-Time')
+        if 'iterations' in result:
+            # the app ran the operations several times and sent back a
+            # list of values for each key, so spread them over the rows
+            results = [{key: values[i] for (key, values) in result.items()
+                        if isinstance(values, list)}
+                       for i in xrange(result['iterations'])]
+        else:
+            results = [result]
+
+        # Split the round trip into the network (everything outside the
+        # app's handler), the framework (the handler minus the timed
+        # operations) and the backend (the timed operations). Apps that
+        # don't report their handler time get blanks here.
+        op_total = sum(op_time(r, 'del_time') + op_time(r, 'get_time') +
+                       op_time(r, 'set_time') for r in results)
+        queue_time = (actual_start - intended_start) * 1000
+        if handler_time is not None:
+            handler_time = float(handler_time)
+            request_times = [queue_time, rtt * 1000, handler_time * 1000,
+                             (rtt - handler_time) * 1000,
+                             (handler_time - op_total) * 1000]
+        else:
+            request_times = [queue_time, rtt * 1000, '', '', '']
+        request_times += [retried, new_connection]
+
+        rows = []
+        for (i, result) in enumerate(results):
+            correct = result.get('correct', None)
+            del_time = op_time(result, 'del_time')
+            get_time = op_time(result, 'get_time')
+            set_time = op_time(result, 'set_time')
+            # The queue time, rtt, handler time and their split (and
+            # whether the request was retried or opened a connection) are
+            # measured once per request, so only the first row gets them
+            # (the others are left blank, rather than made up).
+            rows.append([datetime.datetime.now(),  # timestamp
+                         test_type,  # type (std or flex)
+                         request,  # url
+                         params,  # number of bytes
+                         correct,  # correctness
+                         del_time * 1000,  # API gives ms
+                         get_time * 1000,
+                         set_time * 1000,
+                         (intended_start - run_start) * 1000,
+                         (actual_start - run_start) * 1000] +
+                        (request_times if i == 0
+                         else [''] * len(request_times)))
+        return rows
+    except Exception:
+        # catch an error if the server returns something unexpected
+        logging.exception('Unexpected error (url %s): %s' %
+                          (sys.exc_info()[0], test_url + request))
+        return []
+
+
+def test_request(request, params_list, num_samples, test_std, num_workers=1,
+                 rate=None, poisson=False, pool_size=None, retries=0,
+                 iterations=1):
+    """Run a test on the [/profile_memcache&bytes=] endpoint.
+
+    - num_workers: number of requests to keep in flight at once
+    - rate: if set, send this many requests per second no matter how long
+      the responses take (open loop), rather than sending a new request
+      whenever a worker is free (closed loop)
+    - poisson: whether to send the requests with Poisson arrivals
+      (only used if rate is set)
+    - pool_size: the number of connections to keep open to the app
+      (defaults to one per worker)
+    - retries: the number of times to retry a failed connection or a
+      502/503/504
+    - iterations: the number of samples the app should take per request
+    """
     # set the url
     test_url = ('https://ka-testing-standard.appspot.com/' if test_std
                 else 'http://khan-cachetest.appspot.com/')
     # set the test type (for logging)
     test_type = 'std' if test_std else 'flex'
 
+    # the workers that make the requests, and the connections they
+    # make them over, shared by all param sets
+    pool = multiprocessing.pool.ThreadPool(num_workers)
+    session = make_session(pool_size or num_workers, retries)
+
     # open the file
     with open('./data/%s%s.csv' %
               (test_type, datetime.datetime.now().strftime("%Y%m%d_%H%M%S")),
@@ -52,33 +284,50 @@ def test_request(request, params_list, num_samples, test_std):
         # run tests
         for (i, params) in enumerate(params_list):
             # log status
-            print('Testing %s/%s: %s (%s/%s param sets)' %
-                  (test_type, request, params, i + 1, len(params_list)))
-
-            # take required number of samples
-            for sample in progress_bar(range(1, num_samples + 1)):
-                # make a request and log the data
-                try:
-                    result = requests.get(test_url + request,
-                                          params=params).json()
-                    correct = result.get('correct', None)
-                    del_time = result.get('del_time', 0)
-                    get_time = result.get('get_time', 0)
-                    set_time = result.get('set_time', 0)
-                    wr.writerow([datetime.datetime.now(),  # timestamp
-                                 test_type,  # type (std or flex)
-                                 request,  # url
-                                 params,  # number of bytes
-                                 correct,  # correctness
-                                 del_time * 1000,  # API gives ms
-                                 get_time * 1000,
-                                 set_time * 1000])
-                except Exception:
-                    # catch an error if the server returns something unexpected
-                    logging.exception('Unexpected error (url %s): %s' %
-                                      (sys.exc_info()[0], test_url + request))
+            print('Testing %s/%s: %s (%s/%s param sets, %s workers)' %
+                  (test_type, request, params, i + 1, len(params_list),
+                   num_workers))
+
+            run_start = clock()
+            sample = functools.partial(take_sample, session, test_url,
+                                       request, params, test_type, run_start)
+            # each request gives us `iterations` samples, except that the
+            # last one only takes as many as we still need
+            batches = [iterations] * (num_samples // iterations)
+            if num_samples % iterations:
+                batches.append(num_samples % iterations)
+            num_requests = len(batches)
+            if rate:
+                # Send the requests on schedule. If all the workers are
+                # busy the request waits in the pool, and that wait is
+                # recorded as its queue time rather than being skipped.
+                results = []
+                for (offset, batch) in progress_bar(
+                        zip(arrival_times(rate, num_requests, poisson),
+                            batches),
+                        total=num_requests):
+                    intended_start = run_start + offset
+                    time.sleep(max(0, intended_start - clock()))
+                    results.append(pool.apply_async(
+                        sample, kwds={'iterations': batch,
+                                      'intended_start': intended_start}))
+                samples = (r.get() for r in results)
+            else:
+                # take required number of samples, keeping num_workers
+                # requests in flight; rows are written (from this thread
+                # only) in the order the responses come back
+                samples = progress_bar(
+                    pool.imap_unordered(
+                        lambda batch: sample(iterations=batch), batches),
+                    total=num_requests)
+            for rows in samples:
+                # log the data
+                wr.writerows(rows)
             print('Finished param set %s.' % (i + 1))
 
+    pool.close()
+    pool.join()
+
 if __name__ == '__main__':
     PARAM_SETS = None  # no special parameter sets
     # By default, you can specify the byte size parameter.
@@ -95,6 +344,24 @@ if __name__ == '__main__':
                         help='The number of samples to run')
     parser.add_argument('--test-url', '-u', default='profile_memcache',
                         help='The endpoint to make the request to')
+    parser.add_argument('--workers', '-w', default=1, type=int,
+                        help='The number of requests to keep in flight')
+    parser.add_argument('--rate', '-r', type=float,
+                        help='Send this many requests per second (open loop), '
+                             'rather than one per free worker; make sure '
+                             'there are enough workers to keep up')
+    parser.add_argument('--poisson', action='store_true',
+                        help='Use Poisson arrivals in --rate mode')
+    parser.add_argument('--iterations', '-i', default=1, type=int,
+                        help='The number of samples the app should take '
+                             'per request')
+    parser.add_argument('--pool-size', '-p', type=int,
+                        help='The number of connections to keep open '
+                             '(defaults to the number of workers)')
+    parser.add_argument('--retries', default=0, type=int,
+                        help='The number of times to retry a failed '
+                             'connection or a 502/503/504 (retried samples '
+                             'are marked in the retried column)')
     if not PARAM_SETS:
         # If special param sets are not specified, set this as
         # a command line option.
@@ -102,6 +369,9 @@ if __name__ == '__main__':
                             nargs='+', help='The byte sizes to run tests on')
 
     args = parser.parse_args()
+    if args.iterations < 1:
+        # (the app rejects these too)
+        parser.error('--iterations must be at least 1')
 
     if not PARAM_SETS:
         # PARAM_SETS has not been set, so set it equal to the
@@ -109,4 +379,7 @@ if __name__ == '__main__':
         PARAM_SETS = [{'bytes': n} for n in args.num_bytes]
 
     test_request(args.test_url, PARAM_SETS, args.num_samples,
-                 test_std=(args.type == 's'))
+                 test_std=(args.type == 's'), num_workers=args.workers,
+                 rate=args.rate, poisson=args.poisson,
+                 pool_size=args.pool_size, retries=args.retries,
+                 iterations=args.iterations)
@@ -0,0 +1,49 @@
+"""Tests for the request schedule of test.py's --rate mode."""
+import sys
+import unittest
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("test.py is Python 2 only")
+
+import random
+
+import util
+
+loadtest = util.load('test.py', 'loadtest')
+
+
+class ArrivalTimesTest(unittest.TestCase):
+
+    def test_fixed_schedule(self):
+        times = list(loadtest.arrival_times(4, 6, poisson=False))
+        self.assertEqual(times, [0.0, 0.25, 0.5, 0.75, 1.0, 1.25])
+
+    def test_no_samples(self):
+        self.assertEqual(list(loadtest.arrival_times(10, 0, False)), [])
+        self.assertEqual(list(loadtest.arrival_times(10, 0, True)), [])
+
+    def test_poisson_count_and_order(self):
+        random.seed(1)
+        times = list(loadtest.arrival_times(100, 1000, poisson=True))
+        self.assertEqual(len(times), 1000)
+        self.assertTrue(times[0] > 0)
+        self.assertTrue(all(a < b for (a, b) in zip(times, times[1:])))
+
+    def test_poisson_rate(self):
+        # the gaps are exponential with mean 1 / rate, so the last of n
+        # arrivals is at ~ n / rate (with a std dev of sqrt(n) / rate)
+        random.seed(2)
+        times = list(loadtest.arrival_times(50, 10000, poisson=True))
+        self.assertAlmostEqual(times[-1], 10000 / 50.0, delta=10)
+
+    def test_poisson_gaps_vary(self):
+        random.seed(3)
+        times = list(loadtest.arrival_times(10, 100, poisson=True))
+        gaps = [b - a for (a, b) in zip(times, times[1:])]
+        # unlike the fixed schedule, some gaps are well over/under 1 / rate
+        self.assertTrue(min(gaps) < 0.05)
+        self.assertTrue(max(gaps) > 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+"""Tests for the get coalescers of both apps."""
+import sys
+import unittest
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("The apps are Python 2 only")
+
+import threading
+import time
+import traceback
+
+import util
+
+
+class FakeClient(object):
+    """A memcache client's get_multi, which records the batches it gets."""
+
+    def __init__(self, values, error=None):
+        self.values = values
+        self.error = error
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def get_multi(self, keys):
+        with self._lock:
+            self.batches.append(sorted(keys))
+        if self.error:
+            raise self.error
+        return {k: self.values[k] for k in keys if k in self.values}
+
+
+class CoalescerTest(object):
+    """The tests, for the coalescer module of each app."""
+
+    coalescer = None
+
+    def get_at_once(self, coalescer, keys):
+        """Get the keys from a thread each, all at once.
+
+        Return: the value (or exception) each thread got.
+        """
+        results = [None] * len(keys)
+        start = threading.Event()
+
+        def get(i):
+            start.wait()
+            try:
+                results[i] = coalescer.get(keys[i])
+            except Exception as e:
+                results[i] = e
+        threads = [threading.Thread(target=get, args=(i,))
+                   for i in xrange(len(keys))]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_single_get(self):
+        client = FakeClient({'a': 1})
+        coalescer = self.coalescer.Coalescer(client.get_multi, window=0)
+        self.assertEqual(coalescer.get('a'), 1)
+        self.assertIsNone(coalescer.get('missing'))
+        self.assertEqual(client.batches, [['a'], ['missing']])
+        self.assertEqual(coalescer.batches, 2)
+
+    def test_concurrent_gets_share_a_batch(self):
+        client = FakeClient({'a': 1, 'b': 2, 'c': 3})
+        coalescer = self.coalescer.Coalescer(client.get_multi, window=1,
+                                             max_batch=5)
+        results = self.get_at_once(coalescer, ['a', 'b', 'c', 'a', 'd'])
+        self.assertEqual(results, [1, 2, 3, 1, None])
+        # the batch was full, and the repeated key was only got once
+        self.assertEqual(client.batches, [['a', 'b', 'c', 'd']])
+        self.assertEqual(coalescer.batches, 1)
+
+    def test_max_batch(self):
+        client = FakeClient({str(i): i for i in xrange(10)})
+        coalescer = self.coalescer.Coalescer(client.get_multi, window=1,
+                                             max_batch=3)
+        keys = [str(i) for i in xrange(9)]
+        results = self.get_at_once(coalescer, keys)
+        self.assertEqual(results, range(9))
+        self.assertTrue(all(len(batch) <= 3 for batch in client.batches))
+        self.assertEqual(sorted(k for batch in client.batches
+                                for k in batch), keys)
+
+    def test_full_batch_doesnt_wait(self):
+        client = FakeClient({'a': 1})
+        coalescer = self.coalescer.Coalescer(client.get_multi, window=10,
+                                             max_batch=1)
+        start = time.time()
+        self.assertEqual(coalescer.get('a'), 1)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_errors_reach_every_caller(self):
+        client = FakeClient({}, error=KeyError('boom'))
+        coalescer = self.coalescer.Coalescer(client.get_multi, window=1,
+                                             max_batch=3)
+        results = self.get_at_once(coalescer, ['a', 'b', 'c'])
+        self.assertEqual(len(client.batches), 1)
+        for result in results:
+            self.assertIsInstance(result, KeyError)
+
+    def test_errors_keep_their_traceback(self):
+        client = FakeClient({}, error=KeyError('boom'))
+        coalescer = self.coalescer.Coalescer(client.get_multi, window=0)
+        try:
+            coalescer.get('a')
+        except KeyError:
+            frames = traceback.extract_tb(sys.exc_info()[2])
+        else:
+            self.fail("The error wasn't raised")
+        # the traceback goes on into the get_multi that raised
+        self.assertEqual(frames[-1][2], 'get_multi')
+
+    def test_next_batch_after_error(self):
+        client = FakeClient({'a': 1}, error=KeyError('boom'))
+        coalescer = self.coalescer.Coalescer(client.get_multi, window=0)
+        with self.assertRaises(KeyError):
+            coalescer.get('a')
+        client.error = None
+        self.assertEqual(coalescer.get('a'), 1)
+
+
+class FlexCoalescerTest(CoalescerTest, unittest.TestCase):
+    coalescer = util.load_app('flex', 'coalescer')
+
+
+class StandardCoalescerTest(CoalescerTest, unittest.TestCase):
+    coalescer = util.load_app('standard', 'coalescer')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+"""Tests for the local caches of both apps."""
+import sys
+import unittest
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("The apps are Python 2 only")
+
+import util
+
+
+class FakeClient(object):
+    """A memcache client backed by a dict, which counts its gets."""
+
+    def __init__(self):
+        self.values = {}
+        self.gets = 0
+        self.fail_sets = False
+
+    def get(self, key):
+        self.gets += 1
+        return self.values.get(key)
+
+    def set(self, key, value):
+        if self.fail_sets:
+            return False
+        self.values[key] = value
+        return True
+
+    def delete(self, key):
+        return self.values.pop(key, None) is not None
+
+
+class FakeClock(object):
+    """A stand-in for the time module, which only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class LocalCacheTest(object):
+    """The tests, for the local_cache module of each app."""
+
+    local_cache = None
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.clock = FakeClock()
+        self.real_time = self.local_cache.time
+        self.local_cache.time = self.clock
+
+    def tearDown(self):
+        self.local_cache.time = self.real_time
+
+    def make_cache(self, max_bytes=100, ttl=None):
+        return self.local_cache.LocalCache(self.client, max_bytes, ttl)
+
+    def test_reads_through_and_hits(self):
+        self.client.values['k'] = 'value'
+        cache = self.make_cache()
+        self.assertEqual(cache.get('k'), 'value')
+        self.assertEqual(cache.get('k'), 'value')
+        self.assertEqual(self.client.gets, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_missing_keys_arent_cached(self):
+        cache = self.make_cache()
+        self.assertIsNone(cache.get('k'))
+        self.assertIsNone(cache.get('k'))
+        self.assertEqual(self.client.gets, 2)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_evicts_least_recently_used(self):
+        # each entry is 1 + 9 = 10 bytes, so three fit in 30
+        cache = self.make_cache(max_bytes=30)
+        for key in 'abc':
+            cache.set(key, key * 9)
+        # reading a makes b the least recently used
+        cache.get('a')
+        cache.set('d', 'd' * 9)
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes'],
+                          stats['evictions']), (3, 30, 1))
+        gets = self.client.gets
+        for key in 'acd':
+            cache.get(key)
+        self.assertEqual(self.client.gets, gets)
+        cache.get('b')
+        self.assertEqual(self.client.gets, gets + 1)
+
+    def test_evicts_enough_for_big_values(self):
+        cache = self.make_cache(max_bytes=30)
+        for key in 'abc':
+            cache.set(key, key * 9)
+        cache.set('e', 'e' * 19)
+        self.assertEqual(cache.evictions, 2)
+        self.assertEqual(cache.size, 30)
+
+    def test_too_big_to_cache(self):
+        cache = self.make_cache(max_bytes=10)
+        self.assertTrue(cache.set('k', 'x' * 10))
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(cache.get('k'), 'x' * 10)
+        self.assertEqual(self.client.gets, 1)
+
+    def test_replacing_a_value_updates_the_size(self):
+        cache = self.make_cache()
+        cache.set('k', 'short')
+        cache.set('k', 'a longer value')
+        self.assertEqual(cache.size, len('k') + len('a longer value'))
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_ttl(self):
+        cache = self.make_cache(ttl=10)
+        cache.set('k', 'value')
+        self.clock.now += 9
+        cache.get('k')
+        self.assertEqual(self.client.gets, 0)
+        self.clock.now += 2
+        self.client.values['k'] = 'new value'
+        self.assertEqual(cache.get('k'), 'new value')
+        self.assertEqual(self.client.gets, 1)
+        self.assertEqual(cache.size, len('k') + len('new value'))
+
+    def test_ttl_per_set(self):
+        cache = self.make_cache(ttl=100)
+        cache.set('short', 'value', ttl=1)
+        cache.set('long', 'value')
+        self.clock.now += 2
+        cache.get('short')
+        cache.get('long')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_no_ttl(self):
+        cache = self.make_cache()
+        cache.set('k', 'value')
+        self.clock.now += 1e9
+        cache.get('k')
+        self.assertEqual(self.client.gets, 0)
+
+    def test_failed_set_drops_the_old_value(self):
+        cache = self.make_cache()
+        cache.set('k', 'old')
+        self.client.fail_sets = True
+        self.assertFalse(cache.set('k', 'new'))
+        self.assertEqual(cache.get('k'), 'old')
+        self.assertEqual(self.client.gets, 1)
+
+    def test_invalidate_and_delete(self):
+        cache = self.make_cache()
+        cache.set('a', 'value')
+        cache.set('b', 'value')
+        cache.invalidate('a')
+        self.assertEqual(self.client.values,
+                         {'a': 'value', 'b': 'value'})
+        self.assertTrue(cache.delete('b'))
+        self.assertEqual(self.client.values, {'a': 'value'})
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(cache.get('a'), 'value')
+        self.assertIsNone(cache.get('b'))
+
+    def test_stats(self):
+        cache = self.make_cache()
+        self.assertIsNone(cache.stats()['hit_ratio'])
+        cache.set('k', 'value')
+        for _ in xrange(3):
+            cache.get('k')
+        cache.get('missing')
+        self.assertEqual(cache.stats(), {
+            'hits': 3, 'misses': 1, 'hit_ratio': 0.75, 'evictions': 0,
+            'entries': 1, 'bytes': len('k') + len('value'),
+        })
+
+
+class FlexLocalCacheTest(LocalCacheTest, unittest.TestCase):
+    local_cache = util.load_app('flex', 'local_cache')
+
+
+class StandardLocalCacheTest(LocalCacheTest, unittest.TestCase):
+    local_cache = util.load_app('standard', 'local_cache')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""Tests for parse_data.DataFile's sidecar cache."""
+import sys
+import unittest
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("parse_data.py is Python 2 only")
+
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import util
+
+parse_data = util.load('parse_data.py', 'parse_data')
+
+HEADER = ('timestamp,type,request_url,params,correct,'
+          'del_time (ms),get_time (ms),set_time (ms),rtt (ms)\n')
+ROWS = [
+    "2017-06-01 10:00:00,std,profile_memcache,\"{'bytes': 10}\",True,"
+    "1.5,2.5,3.5,10\n",
+    "2017-06-01 10:00:01,std,profile_memcache,\"{'bytes': 10000}\",True,"
+    "4.5,5.5,6.5,\n",
+    "2017-06-01 10:00:02,std,profile_memcache,\"{'bytes': 10}\",True,"
+    "7.5,8.5,9.5,11\n",
+    "2017-06-01 10:00:03,std,profile_memcache,"
+    "\"{'bytes': 10, 'mode': 'a,b'}\",True,1,2,3,12\n",
+]
+
+
+class DataFileCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'data.csv')
+        self.cache_file = self.filename + parse_data.CACHE_SUFFIX
+        self.write(ROWS)
+        # unreadable caches are logged with their tracebacks
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.directory)
+
+    def write(self, rows):
+        with open(self.filename, 'w') as f:
+            f.write(HEADER + ''.join(rows))
+
+    def assert_same(self, loaded, parsed):
+        for attr in ('columns', 'data_columns', 'params', 'types', 'type',
+                     'endpoint', 'timestamp', 'index'):
+            self.assertEqual(getattr(loaded, attr), getattr(parsed, attr),
+                             attr)
+        np.testing.assert_array_equal(loaded.data, parsed.data)
+        for params in parsed.params:
+            np.testing.assert_array_equal(loaded.get_group(params),
+                                          parsed.get_group(params))
+
+    def test_round_trip(self):
+        parsed = parse_data.DataFile.load(self.filename)
+        self.assertTrue(os.path.exists(self.cache_file))
+        loaded = parse_data.DataFile._read_cache(self.filename)
+        self.assertIsNotNone(loaded)
+        self.assert_same(loaded, parsed)
+        self.assert_same(loaded, parse_data.DataFile(self.filename))
+
+    def test_parsed_values(self):
+        data = parse_data.DataFile.load(self.filename)
+        self.assertEqual(data.params, ["{'bytes': 10}", "{'bytes': 10000}",
+                                       "{'bytes': 10, 'mode': 'a,b'}"])
+        self.assertEqual((data.type, data.endpoint),
+                         ('std', 'profile_memcache'))
+        get_time = data.data_columns.index('get_time (ms)')
+        np.testing.assert_array_equal(
+            data.get_group({'bytes': 10})[:, get_time], [2.5, 8.5])
+        # blank values are NaN
+        rtt = data.data_columns.index('rtt (ms)')
+        self.assertTrue(np.isnan(data.get_group({'bytes': 10000})[0, rtt]))
+
+    def test_second_load_reads_cache(self):
+        parse_data.DataFile.load(self.filename)
+        original_init = parse_data.DataFile.__init__
+
+        def fail(data, filename):
+            self.fail("The csv file was parsed again")
+        parse_data.DataFile.__init__ = fail
+        try:
+            loaded = parse_data.DataFile.load(self.filename)
+        finally:
+            parse_data.DataFile.__init__ = original_init
+        self.assertEqual(len(loaded.params), 3)
+
+    def test_changed_file_is_parsed_again(self):
+        parse_data.DataFile.load(self.filename)
+        self.write(ROWS[:2])
+        self.assertIsNone(parse_data.DataFile._read_cache(self.filename))
+        data = parse_data.DataFile.load(self.filename)
+        self.assertEqual(len(data.data), 2)
+        # and the cache is rewritten
+        self.assert_same(parse_data.DataFile._read_cache(self.filename),
+                         data)
+
+    def test_unreadable_cache_is_ignored(self):
+        parse_data.DataFile.load(self.filename)
+        with open(self.cache_file, 'wb') as f:
+            f.write('not a cache')
+        self.assertIsNone(parse_data.DataFile._read_cache(self.filename))
+        data = parse_data.DataFile.load(self.filename)
+        self.assertEqual(len(data.data), len(ROWS))
+
+    def test_old_version_is_ignored(self):
+        parse_data.DataFile.load(self.filename)
+        original_version = parse_data.CACHE_VERSION
+        parse_data.CACHE_VERSION = original_version + 1
+        try:
+            self.assertIsNone(
+                parse_data.DataFile._read_cache(self.filename))
+        finally:
+            parse_data.CACHE_VERSION = original_version
+
+    def test_no_cache(self):
+        parse_data.DataFile.load(self.filename, use_cache=False)
+        self.assertFalse(os.path.exists(self.cache_file))
+
+    def test_prune_cache(self):
+        sizes = []
+        for (i, mtime) in enumerate([300, 100, 200]):
+            path = os.path.join(self.directory, '%d.csv' % i)
+            shutil.copy(self.filename, path)
+            parse_data.DataFile.load(path)
+            os.utime(path + parse_data.CACHE_SUFFIX, (mtime, mtime))
+            sizes.append(os.path.getsize(path + parse_data.CACHE_SUFFIX))
+        # room for two caches, so the least recently used one goes
+        parse_data.prune_cache([self.directory], sum(sizes[:2]))
+        remaining = sorted(name for name in os.listdir(self.directory)
+                           if name.endswith(parse_data.CACHE_SUFFIX))
+        self.assertEqual(remaining, ['0.csv' + parse_data.CACHE_SUFFIX,
+                                     '2.csv' + parse_data.CACHE_SUFFIX])
+
+
+class StreamFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'data.csv')
+        with open(self.filename, 'w') as f:
+            f.write(HEADER + ''.join(ROWS))
+        # read a row at a time, so later param sets start in later chunks
+        self.chunk_size = parse_data.DataFile.CHUNK_SIZE
+        parse_data.DataFile.CHUNK_SIZE = 1
+
+    def tearDown(self):
+        parse_data.DataFile.CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.directory)
+
+    def test_timestamps_match_data_file(self):
+        sketches = parse_data.stream_file(self.filename, 0.01, {})
+        data = parse_data.DataFile(self.filename)
+        self.assertEqual({timestamp for (timestamp, _) in sketches.values()},
+                         {data.timestamp})
+
+    def test_sketches(self):
+        sketches = parse_data.stream_file(self.filename, 0.01, {})
+        key = ('std', 'profile_memcache', "{'bytes': 10}", 'get_time (ms)')
+        s = sketches[key][1]
+        self.assertEqual((s.count, s.min, s.max), (2, 2.5, 8.5))
+        # blank values are left out
+        self.assertNotIn(('std', 'profile_memcache', "{'bytes': 10000}",
+                          'rtt (ms)'), sketches)
+
+
+if __name__ == '__main__':
+    unittest.main()
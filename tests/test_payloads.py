@@ -0,0 +1,83 @@
+"""Tests for the payload pools of both apps."""
+import sys
+import unittest
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("The apps are Python 2 only")
+
+import base64
+import os
+import string
+import zlib
+
+import util
+
+
+class PayloadsTest(object):
+    """The tests, for the payloads module of each app."""
+
+    payloads = None
+
+    def test_sizes(self):
+        for num_bytes in (0, 1, 2, 3, 255, 256, 257, 1000, 1 << 16):
+            value = self.payloads.get_bytes(num_bytes)
+            self.assertIsInstance(value, str)
+            self.assertEqual(len(value), num_bytes)
+
+    def test_size_classes(self):
+        for num_bytes in (5, 100, 1000, 4097):
+            self.payloads.get_bytes(num_bytes)
+        sizes = sorted(size for (size, kind) in self.payloads._classes
+                       if kind == self.payloads.RANDOM)
+        for size in (8, 128, 1024, 8192):
+            self.assertIn(size, sizes)
+        # every size class is a power of two, big enough for its values
+        # plus a rotation's worth of offsets
+        for ((size, kind), size_class) in self.payloads._classes.items():
+            self.assertEqual(size & (size - 1), 0)
+            self.assertTrue(len(size_class.data) >=
+                            size + self.payloads.ROTATIONS - 1)
+
+    def test_values_are_slices_of_their_class(self):
+        value = self.payloads.get_bytes(600)
+        self.assertIn(value,
+                      self.payloads._classes[(1024,
+                                              self.payloads.RANDOM)].data)
+
+    def test_consecutive_values_differ(self):
+        values = [self.payloads.get_bytes(64) for _ in xrange(100)]
+        self.assertEqual(len(set(values)), 100)
+
+    def test_values_repeat_after_rotations(self):
+        rotations = self.payloads.ROTATIONS
+        values = [self.payloads.get_bytes(32) for _ in xrange(rotations + 1)]
+        self.assertEqual(values[0], values[-1])
+        self.assertEqual(len(set(values)), rotations)
+
+    def test_text(self):
+        for num_bytes in (0, 1, 2, 3, 10, 1000):
+            text = self.payloads.get_text(num_bytes)
+            self.assertEqual(len(text),
+                             len(base64.b64encode(os.urandom(num_bytes))))
+            self.assertTrue(set(text) <=
+                            set(string.ascii_letters + string.digits + '+/'))
+
+    def test_compressible(self):
+        data = self.payloads.get_compressible(100000)
+        self.assertEqual(len(data), 100000)
+        self.assertTrue(len(zlib.compress(data)) < len(data) / 2)
+        # random data doesn't compress at all
+        random = self.payloads.get_bytes(100000)
+        self.assertTrue(len(zlib.compress(random)) > len(random) * 0.99)
+
+
+class FlexPayloadsTest(PayloadsTest, unittest.TestCase):
+    payloads = util.load_app('flex', 'payloads')
+
+
+class StandardPayloadsTest(PayloadsTest, unittest.TestCase):
+    payloads = util.load_app('standard', 'payloads')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Tests for sketch.LatencySketch."""
+import sys
+import unittest
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("sketch.py is Python 2 only")
+
+import json
+
+import numpy as np
+
+import util
+
+sketch = util.load('sketch.py', 'sketch')
+
+PERCENTILES = [0, 1, 10, 50, 90, 95, 99, 99.9, 100]
+
+
+class LatencySketchTest(unittest.TestCase):
+
+    def assert_within_error(self, s, values):
+        """Check every percentile of the sketch against the exact values."""
+        values = np.sort(values)
+        for p in PERCENTILES:
+            # the sketch reads back the value at this rank (rather than
+            # interpolating between neighbours, as np.percentile does)
+            exact = values[int(p / 100.0 * (len(values) - 1))]
+            got = s.percentile(p)
+            self.assertTrue(
+                abs(got - exact) <= s.relative_error * abs(exact) + 1e-12,
+                "p%s: %s isn't within %s of %s" % (p, got, s.relative_error,
+                                                    exact))
+
+    def test_percentile_error_bound(self):
+        values = np.random.RandomState(1).lognormal(0, 2, 20000)
+        for relative_error in (0.001, 0.01, 0.05):
+            s = sketch.LatencySketch(relative_error)
+            s.add_many(values)
+            self.assert_within_error(s, values)
+
+    def test_negative_and_zero_values(self):
+        random = np.random.RandomState(2)
+        values = np.concatenate([random.normal(0, 10, 5000),
+                                 np.zeros(500)])
+        s = sketch.LatencySketch(0.01)
+        s.add_many(values)
+        self.assertEqual(s.zero_count, 500)
+        self.assert_within_error(s, values)
+
+    def test_percentiles_within_min_and_max(self):
+        s = sketch.LatencySketch(0.05)
+        s.add_many([1.234, 5.678, 3.0])
+        self.assertEqual((s.min, s.max), (1.234, 5.678))
+        self.assertEqual(s.percentile(100), 5.678)
+        for p in PERCENTILES:
+            self.assertTrue(1.234 <= s.percentile(p) <= 5.678)
+
+    def test_add_one_at_a_time(self):
+        values = np.random.RandomState(3).exponential(5, 500)
+        one_by_one = sketch.LatencySketch()
+        for value in values:
+            one_by_one.add(value)
+        together = sketch.LatencySketch()
+        together.add_many(values)
+        self.assertEqual(one_by_one.to_dict(), together.to_dict())
+
+    def test_merge_matches_single_sketch(self):
+        random = np.random.RandomState(4)
+        values = np.concatenate([random.lognormal(1, 1, 3000),
+                                 -random.lognormal(0, 1, 100)])
+        first = sketch.LatencySketch(0.01)
+        first.add_many(values[::2])
+        second = sketch.LatencySketch(0.01)
+        second.add_many(values[1::2])
+        first.merge(second)
+        whole = sketch.LatencySketch(0.01)
+        whole.add_many(values)
+        self.assertEqual(first.to_dict(), whole.to_dict())
+        self.assert_within_error(first, values)
+
+    def test_merge_empty(self):
+        s = sketch.LatencySketch()
+        s.add_many([1.0, 2.0])
+        s.merge(sketch.LatencySketch())
+        self.assertEqual((s.count, s.min, s.max), (2, 1.0, 2.0))
+        empty = sketch.LatencySketch()
+        empty.merge(s)
+        self.assertEqual(empty.to_dict(), s.to_dict())
+
+    def test_merge_different_errors(self):
+        with self.assertRaises(ValueError):
+            sketch.LatencySketch(0.01).merge(sketch.LatencySketch(0.02))
+
+    def test_json_round_trip(self):
+        s = sketch.LatencySketch(0.02)
+        s.add_many(np.random.RandomState(5).normal(50, 20, 1000))
+        loaded = sketch.LatencySketch.from_dict(
+            json.loads(json.dumps(s.to_dict())))
+        self.assertEqual(loaded.to_dict(), s.to_dict())
+        for p in PERCENTILES:
+            self.assertEqual(loaded.percentile(p), s.percentile(p))
+
+    def test_empty_percentile(self):
+        with self.assertRaises(ValueError):
+            sketch.LatencySketch().percentile(50)
+
+    def test_bad_relative_error(self):
+        for relative_error in (0, 1, -0.1):
+            with self.assertRaises(ValueError):
+                sketch.LatencySketch(relative_error)
+
+
+if __name__ == '__main__':
+    unittest.main()
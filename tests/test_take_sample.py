@@ -0,0 +1,167 @@
+"""Tests for turning test.py's responses into rows of the CSV file."""
+import sys
+import unittest
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("test.py is Python 2 only")
+
+import BaseHTTPServer
+import json
+import threading
+
+import util
+
+loadtest = util.load('test.py', 'loadtest')
+
+
+class FakeResponse(object):
+
+    # (the urllib3 response, which says whether the request was retried)
+    raw = None
+
+    def __init__(self, result, handler_time=None):
+        self.result = result
+        self.headers = ({} if handler_time is None
+                        else {'X-Handler-Time': str(handler_time)})
+
+    def json(self):
+        return self.result
+
+
+class FakeSession(object):
+    """A session that sends back the same response to every request."""
+
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append((url, params))
+        return self.response
+
+
+class TakeSampleTest(unittest.TestCase):
+
+    def take_sample(self, result, handler_time=None, iterations=1):
+        session = FakeSession(FakeResponse(result, handler_time))
+        return loadtest.take_sample(session, 'http://app/', 'profile_x',
+                                    {'bytes': 10}, 'flex',
+                                    loadtest.clock(), iterations=iterations)
+
+    def column(self, rows, name):
+        return [row[loadtest.HEADER_ROW.index(name)] for row in rows]
+
+    def test_op_times(self):
+        rows = self.take_sample({'get_time': 0.002, 'set_time': 0.003,
+                                 'del_time': 0.001, 'correct': True}, 0.01)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(len(rows[0]), len(loadtest.HEADER_ROW))
+        self.assertEqual(self.column(rows, 'get_time (ms)'), [2])
+        self.assertEqual(self.column(rows, 'set_time (ms)'), [3])
+        self.assertEqual(self.column(rows, 'del_time (ms)'), [1])
+        self.assertEqual(self.column(rows, 'handler_time (ms)'), [10])
+        # the handler time that wasn't spent in the operations
+        self.assertAlmostEqual(
+            self.column(rows, 'framework_time (ms)')[0], 4)
+
+    def test_missing_and_null_times(self):
+        # e.g. a workload with no writes
+        rows = self.take_sample({'get_time': 0.002, 'set_time': None,
+                                 'correct': True}, 0.01)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(self.column(rows, 'set_time (ms)'), [0])
+        self.assertEqual(self.column(rows, 'del_time (ms)'), [0])
+        self.assertAlmostEqual(
+            self.column(rows, 'framework_time (ms)')[0], 8)
+
+    def test_iterations(self):
+        rows = self.take_sample({'get_time': [0.001, None, 0.003],
+                                 'correct': [True, True, False],
+                                 'iterations': 3}, 0.01, iterations=3)
+        self.assertEqual(self.column(rows, 'get_time (ms)'), [1, 0, 3])
+        self.assertEqual(self.column(rows, 'correct'), [True, True, False])
+        # the request-level times are only on the first row
+        handler_times = self.column(rows, 'handler_time (ms)')
+        self.assertEqual(handler_times[1:], ['', ''])
+        self.assertAlmostEqual(
+            self.column(rows, 'framework_time (ms)')[0], 6)
+
+    def test_no_handler_time(self):
+        rows = self.take_sample({'get_time': 0.002})
+        self.assertEqual(self.column(rows, 'handler_time (ms)'), [''])
+        self.assertEqual(self.column(rows, 'framework_time (ms)'), [''])
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Sends back a result, after failing the first server.failures times."""
+
+    # keep connections alive
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.server.failures:
+            self.server.failures -= 1
+            status = 503
+        else:
+            status = 200
+        body = json.dumps({'get_time': 0.001, 'correct': status == 200})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SessionTest(unittest.TestCase):
+    """Tests of the retried and new_connection columns, against a server."""
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.failures = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def take_sample(self, session):
+        rows = loadtest.take_sample(session, self.url, 'profile_x',
+                                    {'bytes': 10}, 'flex', loadtest.clock())
+        self.assertEqual(len(rows), 1)
+        return dict(zip(loadtest.HEADER_ROW, rows[0]))
+
+    def test_new_connections(self):
+        session = loadtest.make_session(1, 0)
+        first = self.take_sample(session)
+        second = self.take_sample(session)
+        self.assertEqual((first['new_connection'], first['retried']),
+                         (True, False))
+        self.assertEqual((second['new_connection'], second['retried']),
+                         (False, False))
+
+    def test_no_retries(self):
+        # the 503 is recorded as it is
+        self.server.failures = 1
+        row = self.take_sample(loadtest.make_session(1, 0))
+        self.assertEqual((row['correct'], row['retried']), (False, False))
+
+    def test_retries(self):
+        self.server.failures = 1
+        row = self.take_sample(loadtest.make_session(1, 2))
+        self.assertEqual((row['correct'], row['retried']), (True, True))
+
+    def test_out_of_retries(self):
+        # the last failure is recorded, rather than raising
+        self.server.failures = 3
+        row = self.take_sample(loadtest.make_session(1, 2))
+        self.assertEqual((row['correct'], row['retried']), (False, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
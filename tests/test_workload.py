@@ -0,0 +1,114 @@
+"""Tests for the workload generators of both apps."""
+import sys
+import unittest
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("The apps are Python 2 only")
+
+import collections
+import random
+
+import util
+
+
+class WorkloadTest(object):
+    """The tests, for the workload module of each app."""
+
+    workload = None
+
+    def setUp(self):
+        random.seed(0)
+
+    def key_counts(self, w, num_ops):
+        """Count how often each key number comes up in num_ops ops."""
+        prefix = w.prefix + '_'
+        return collections.Counter(int(key[len(prefix):])
+                                   for (_, key) in w.ops(num_ops))
+
+    def test_bad_params(self):
+        Workload = self.workload.Workload
+        with self.assertRaises(ValueError):
+            Workload('p', 10, distribution='normal')
+        with self.assertRaises(ValueError):
+            Workload('p', 10, distribution=self.workload.RECORDED)
+        with self.assertRaises(ValueError):
+            Workload('p', 0)
+        with self.assertRaises(ValueError):
+            Workload('p', self.workload.MAX_KEYS + 1)
+
+    def test_key_names(self):
+        w = self.workload.Workload('prefix', 10)
+        self.assertEqual(w.key(3), 'prefix_3')
+        self.assertEqual(w.key(13), 'prefix_3')
+
+    def test_uniform(self):
+        w = self.workload.Workload('p', 10,
+                                   distribution=self.workload.UNIFORM)
+        counts = self.key_counts(w, 10000)
+        self.assertEqual(sorted(counts), range(10))
+        for n in counts.values():
+            self.assertAlmostEqual(n, 1000, delta=150)
+
+    def test_zipfian(self):
+        w = self.workload.Workload('p', 1000, skew=1.0)
+        counts = self.key_counts(w, 50000)
+        self.assertTrue(all(0 <= i < 1000 for i in counts))
+        # with a skew of 1, key i comes up 1 / (i + 1) as often as key 0
+        self.assertEqual(counts.most_common(1)[0][0], 0)
+        self.assertAlmostEqual(float(counts[1]) / counts[0], 0.5,
+                               delta=0.05)
+        self.assertAlmostEqual(float(counts[9]) / counts[0], 0.1,
+                               delta=0.02)
+
+    def test_zipfian_no_skew_is_uniform(self):
+        w = self.workload.Workload('p', 10, skew=0)
+        for n in self.key_counts(w, 10000).values():
+            self.assertAlmostEqual(n, 1000, delta=150)
+
+    def test_recorded(self):
+        w = self.workload.Workload('p', 10,
+                                   distribution=self.workload.RECORDED,
+                                   trace=[3, 1, 4])
+        keys = [key for (_, key) in w.ops(4) + w.ops(3)]
+        self.assertEqual(keys, ['p_3', 'p_1', 'p_4', 'p_3', 'p_1', 'p_4',
+                                'p_3'])
+
+    def test_read_fraction(self):
+        def writes(read_fraction):
+            w = self.workload.Workload('p', 10, read_fraction=read_fraction)
+            return sum(1 for (write, _) in w.ops(10000) if write)
+        self.assertEqual(writes(1.0), 0)
+        self.assertEqual(writes(0.0), 10000)
+        self.assertAlmostEqual(writes(0.9), 1000, delta=150)
+
+    def test_zipf_cache_is_bounded(self):
+        size = self.workload.ZIPF_CACHE_SIZE
+        for num_keys in xrange(1, size + 3):
+            self.workload._zipf_cdf(num_keys, 0.5)
+        self.assertEqual(len(self.workload._zipf_cdfs), size)
+        # using a distribution keeps it, and the oldest one goes instead
+        oldest = list(self.workload._zipf_cdfs)[0]
+        cdf = self.workload._zipf_cdf(*oldest)
+        self.workload._zipf_cdf(100, 0.5)
+        self.assertIn(oldest, self.workload._zipf_cdfs)
+        self.assertIs(self.workload._zipf_cdf(*oldest), cdf)
+        self.assertEqual(len(self.workload._zipf_cdfs), size)
+
+    def test_zipf_cdf(self):
+        cdf = self.workload._zipf_cdf(4, 1.0)
+        expected = [1, 1 + 1 / 2.0, 1 + 1 / 2.0 + 1 / 3.0,
+                    1 + 1 / 2.0 + 1 / 3.0 + 1 / 4.0]
+        for (got, want) in zip(cdf, expected):
+            self.assertAlmostEqual(got, want)
+
+
+class FlexWorkloadTest(WorkloadTest, unittest.TestCase):
+    workload = util.load_app('flex', 'workload')
+
+
+class StandardWorkloadTest(WorkloadTest, unittest.TestCase):
+    workload = util.load_app('standard', 'workload')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+"""Helpers for the unit tests.
+
+The tests cover the parts of the repo that don't need App Engine, and run
+on Python 2.7 (with numpy and requests installed) from the repo root:
+
+    python -m unittest discover -s tests
+"""
+import imp
+import os
+import sys
+
+# the root of the repo
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the apps, which each have their own copy of the shared modules
+APPS = ('flex', 'standard')
+
+# parse_data imports sketch from the repo root
+sys.path.insert(0, ROOT)
+
+
+def load(path, name):
+    """Import a module from a file in the repo, under the given name.
+
+    test.py can't be imported as test (that's the standard library's test
+    package), and flex and standard have modules of the same names, so
+    every module gets a name of its own.
+    - path: the path of the file, from the root of the repo
+    """
+    return imp.load_source(name, os.path.join(ROOT, path))
+
+
+def load_app(app, module):
+    """Import one of an app's modules (e.g. load_app('flex', 'payloads'))."""
+    return load(os.path.join(app, module + '.py'), '%s_%s' % (app, module))